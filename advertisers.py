@@ -1,5 +1,60 @@
-from google.cloud import bigquery
+from cache import TTLCache
+import clients
+import id_allocator
 import json
+import os
+import threading
+
+# Advertisers by sourceAdvertiserId, as (id, name) tuples
+advertiser_cache = TTLCache(
+    maxsize=int(os.getenv("ADVERTISER_CACHE_SIZE", "10000")),
+    ttl=int(os.getenv("ADVERTISER_CACHE_TTL", "3600"))
+)
+WARM_ADVERTISER_CACHE = os.getenv("ADVERTISER_CACHE_WARM", "1") == "1"
+_warm_lock = threading.Lock()
+_warmed = False
+
+def warm_advertiser_cache():
+    """Loads every advertiser into the cache with one scan of orders.advertisers.
+
+    Returns:
+        int: Number of advertisers loaded.
+    """
+    bigquery_client = clients.get_bigquery_client()
+    query = """
+    SELECT id, name, oms_id
+    FROM `aos-demo-toolkit.orders.advertisers`
+    WHERE oms_id IS NOT NULL
+    """
+    count = 0
+    for row in bigquery_client.query(query).result():
+        advertiser_cache.set(row["oms_id"], (int(row["id"]), row["name"]))
+        count += 1
+    print(f"Advertiser cache warmed with {count} advertisers")
+    return count
+
+def _ensure_warmed():
+    global _warmed
+    if not WARM_ADVERTISER_CACHE or _warmed:
+        return
+    with _warm_lock:
+        if not _warmed:
+            try:
+                warm_advertiser_cache()
+            except Exception as e:
+                # Fall back to per-advertiser lookups
+                print(f"Error warming advertiser cache: {str(e)}")
+            _warmed = True
+
+def rename_advertiser(bigquery_client, advertiser_id, name):
+    """Updates the advertiser name in BigQuery."""
+    update_query = f"""
+    UPDATE `aos-demo-toolkit.orders.advertisers`
+    SET name = '{name}'
+    WHERE id = {advertiser_id}
+    """
+    update_job = bigquery_client.query(update_query)
+    update_job.result()  # Wait for the update to complete
 
 def upsert_advertiser(name, sourceAdvertiserId):
     """Checks to see if an advertiser exists and returns that ID.
@@ -14,7 +69,19 @@ def upsert_advertiser(name, sourceAdvertiserId):
     advertiser_id = 0
 
     # Get a reference to the BigQuery client and dataset
-    bigquery_client = bigquery.Client()
+    bigquery_client = clients.get_bigquery_client()
+
+    # Answer from the cache when the advertiser is known and unchanged
+    _ensure_warmed()
+    cached = advertiser_cache.get(sourceAdvertiserId)
+    if cached is not None:
+        advertiser_id, cached_name = cached
+        if cached_name != name:
+            print(f"Advertiser name mismatch, updating in database: {cached_name} != {name}")
+            rename_advertiser(bigquery_client, advertiser_id, name)
+            advertiser_cache.set(sourceAdvertiserId, (advertiser_id, name))
+        print(f"Advertiser found in cache with id {advertiser_id} ({advertiser_cache.stats()})")
+        return advertiser_id
 
     # Construct the BigQuery query
     query = f"""
@@ -32,28 +99,15 @@ def upsert_advertiser(name, sourceAdvertiserId):
         advertiser_id = int(first_row[0])
         if first_row[1] != name:
             print(f"Advertiser name mismatch, updating in database: {first_row[1]} != {name}")
-            # Update the advertiser name in BigQuery
-            update_query = f"""
-            UPDATE `aos-demo-toolkit.orders.advertisers`
-            SET name = '{name}'
-            WHERE id = {advertiser_id}
-            """
-            update_job = bigquery_client.query(update_query)
-            update_job.result()  # Wait for the update to complete
+            rename_advertiser(bigquery_client, advertiser_id, name)
+        advertiser_cache.set(sourceAdvertiserId, (advertiser_id, name))
         print(f"Advertiser found with id {advertiser_id}")
     except StopIteration:
         # Advertiser not found
-        # Find the maximum value in the id column
-        max_id_query = """
-        SELECT MAX(id) as max_id
-        FROM `aos-demo-toolkit.orders.advertisers`
-        """
-        max_id_job = bigquery_client.query(max_id_query)
-        max_id_result = max_id_job.result()
-        max_id = next(max_id_result)["max_id"] or 0
+        # Allocate a new id for the advertiser
+        new_id = id_allocator.next_id("advertisers")
 
         # Insert a new row into the table
-        new_id = max_id + 1
         insert_query = f"""
         INSERT INTO `aos-demo-toolkit.orders.advertisers` (id, name, oms_id)
         VALUES ({new_id}, '{name}', '{sourceAdvertiserId}')
@@ -62,6 +116,7 @@ def upsert_advertiser(name, sourceAdvertiserId):
         insert_job.result()  # Wait for the insert to complete
 
         advertiser_id = new_id
+        advertiser_cache.set(sourceAdvertiserId, (advertiser_id, name))
         print(f"New advertiser inserted with id {advertiser_id}")
     return advertiser_id
 
@@ -0,0 +1,99 @@
+import aos_client
+from cache import TTLCache
+import hashlib
+import os
+import requests
+import threading
+
+# Lifetime requested for AOS bearer tokens, in minutes
+TOKEN_EXPIRATION_MINUTES = 360
+
+# Tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = int(os.getenv("AOS_TOKEN_REFRESH_MARGIN", "300"))
+
+# Bearer tokens by (mayiservice URL, tenant, user, password hash, api key)
+token_cache = TTLCache(maxsize=256, ttl=TOKEN_EXPIRATION_MINUTES * 60 - TOKEN_REFRESH_MARGIN)
+
+_locks_lock = threading.Lock()
+_locks = {}
+
+
+def _key_lock(key):
+    with _locks_lock:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def _token_key(mayiservice_url, api_tenant_name, api_user, api_pass, api_key):
+    # The endpoint is public, so a caller with a wrong password must not get another caller's token
+    pass_hash = hashlib.sha256(api_pass.encode("utf-8")).hexdigest()
+    return (mayiservice_url, api_tenant_name, api_user, pass_hash, api_key)
+
+
+def get_bearer_token(mayiservice_url, api_tenant_name, api_user, api_pass, api_key):
+    """Returns an AOS bearer token, reusing a cached one until shortly before it expires.
+
+    Concurrent callers needing the same token wait for a single request to
+    mayiservice instead of each fetching their own.
+
+    Args:
+        mayiservice_url (str): Base URL of the tenant endpoint, e.g. "https://host/mayiservice/tenant/"
+        api_tenant_name (str): AOS tenant
+        api_user (str): AOS API user
+        api_pass (str): AOS API password
+        api_key (str): AOS API key
+
+    Returns:
+        str: The bearer token.
+    """
+    key = _token_key(mayiservice_url, api_tenant_name, api_user, api_pass, api_key)
+    token = token_cache.get(key)
+    if token is not None:
+        return token
+
+    with _key_lock(key):
+        # Another thread may have fetched it while we waited
+        token = token_cache.get(key)
+        if token is not None:
+            return token
+
+        payload = {
+            "expiration": TOKEN_EXPIRATION_MINUTES,
+            "password": api_pass,
+            "userId": api_user,
+            "apiKey": api_key
+        }
+        # Issuing a token has no side effects, so it is safe to retry
+        response = aos_client.post("mayiservice", f"{mayiservice_url}{api_tenant_name}", json=payload, idempotent=True)
+        token = response.json().get("token")
+        token_cache.set(key, token)
+        print(f"Fetched AOS bearer token for {api_user}@{api_tenant_name} ({token_cache.stats()})")
+        return token
+
+
+def invalidate_token(mayiservice_url, api_tenant_name, api_user, api_pass, api_key):
+    """Drops a cached token, e.g. after AOS rejected it."""
+    token_cache.invalidate(_token_key(mayiservice_url, api_tenant_name, api_user, api_pass, api_key))
+
+
+def call_with_token(call, mayiservice_url, api_tenant_name, api_user, api_pass, api_key):
+    """Calls call(token) with a cached bearer token, once more with a fresh token if AOS answers 401.
+
+    A token can be revoked before it expires. AOS does not apply a request it
+    rejects with 401, so the call is repeated even when it is not idempotent.
+
+    Args:
+        call (callable): Makes the AOS requests with the given token
+        mayiservice_url, api_tenant_name, api_user, api_pass, api_key: As for get_bearer_token
+
+    Returns:
+        The return value of call.
+    """
+    token = get_bearer_token(mayiservice_url, api_tenant_name, api_user, api_pass, api_key)
+    try:
+        return call(token)
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 401:
+            raise
+    print(f"AOS rejected the cached token for {api_user}@{api_tenant_name}, fetching a new one")
+    invalidate_token(mayiservice_url, api_tenant_name, api_user, api_pass, api_key)
+    return call(get_bearer_token(mayiservice_url, api_tenant_name, api_user, api_pass, api_key))
@@ -0,0 +1,107 @@
+import os
+import random
+import requests
+from requests.adapters import HTTPAdapter
+import threading
+import time
+
+# Connection pool and timeouts for calls to the AOS APIs
+POOL_MAXSIZE = int(os.getenv("AOS_HTTP_POOL_MAXSIZE", "10"))
+CONNECT_TIMEOUT = float(os.getenv("AOS_HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("AOS_HTTP_READ_TIMEOUT", "30"))
+MAX_ATTEMPTS = int(os.getenv("AOS_HTTP_MAX_ATTEMPTS", "3"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_lock = threading.Lock()
+_session = None
+_metrics = {}  # endpoint -> {"calls", "errors", "total_ms", "max_ms"}
+
+
+def get_session():
+    """Returns the shared keep-alive session used for every AOS call."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def _record(endpoint, elapsed_ms, failed):
+    with _lock:
+        metric = _metrics.setdefault(endpoint, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        metric["calls"] += 1
+        metric["errors"] += int(failed)
+        metric["total_ms"] += elapsed_ms
+        metric["max_ms"] = max(metric["max_ms"], elapsed_ms)
+
+
+def get_metrics():
+    """Returns call count, error count and average/max latency per endpoint.
+
+    Returns:
+        dict: Metrics by endpoint name.
+    """
+    with _lock:
+        return {
+            endpoint: {
+                "calls": metric["calls"],
+                "errors": metric["errors"],
+                "avg_ms": round(metric["total_ms"] / metric["calls"], 1),
+                "max_ms": round(metric["max_ms"], 1),
+            }
+            for endpoint, metric in _metrics.items()
+        }
+
+
+def request(method, endpoint, url, idempotent=None, **kwargs):
+    """Sends a request to AOS over the pooled session, retrying with backoff.
+
+    429 responses are always retried. Other 5xx responses, connection errors
+    and timeouts are only retried for idempotent requests, so a POST that may
+    have been applied is never sent twice.
+
+    Args:
+        method (str): HTTP method
+        endpoint (str): Name the call is recorded under in the metrics, e.g. "psDefinition"
+        url (str): Request URL
+        idempotent (bool): Whether the request is safe to repeat; defaults to True for GET only.
+        **kwargs: Passed to requests.Session.request.
+
+    Returns:
+        requests.Response: The final response; raise_for_status() has been called on it.
+    """
+    if idempotent is None:
+        idempotent = method.upper() == "GET"
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    session = get_session()
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        started_at = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            _record(endpoint, (time.monotonic() - started_at) * 1000, True)
+            if not idempotent or attempt == MAX_ATTEMPTS:
+                raise
+        else:
+            failed = response.status_code >= 400
+            _record(endpoint, (time.monotonic() - started_at) * 1000, failed)
+            retryable = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+            if not retryable or attempt == MAX_ATTEMPTS:
+                response.raise_for_status()  # Raise an exception for HTTP errors
+                return response
+        print(f"AOS {endpoint} call failed on attempt {attempt}, retrying")
+        time.sleep((2 ** (attempt - 1)) * 0.5 + random.uniform(0, 0.5))
+
+
+def get(endpoint, url, **kwargs):
+    return request("GET", endpoint, url, **kwargs)
+
+
+def post(endpoint, url, **kwargs):
+    return request("POST", endpoint, url, **kwargs)
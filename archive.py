@@ -0,0 +1,167 @@
+import atexit
+import clients
+import datetime
+import json
+import os
+import random
+import threading
+import uuid
+
+# Requests and responses are archived as NDJSON batches in this bucket
+ARCHIVE_BUCKET = "aos-demo-toolkit"
+
+# A batch is written when it is this old, this many records or this many bytes
+FLUSH_INTERVAL = float(os.getenv("ARCHIVE_FLUSH_INTERVAL", "10"))
+FLUSH_RECORDS = int(os.getenv("ARCHIVE_FLUSH_RECORDS", "500"))
+FLUSH_BYTES = int(os.getenv("ARCHIVE_FLUSH_BYTES", str(4 * 1024 * 1024)))
+
+# Records beyond this are dropped while GCS is unreachable, to bound memory
+MAX_BUFFERED_RECORDS = int(os.getenv("ARCHIVE_MAX_BUFFERED_RECORDS", "10000"))
+
+# Share of calls archived, by default and per endpoint, e.g. "inventory=0.1,advertisers=0.05".
+# Failed calls are always archived.
+DEFAULT_SAMPLE_RATE = float(os.getenv("ARCHIVE_SAMPLE_RATE", "1"))
+SAMPLE_RATES = {
+    endpoint.strip(): float(rate)
+    for endpoint, rate in (
+        item.split("=", 1) for item in os.getenv("ARCHIVE_SAMPLE_RATES", "").split(",") if "=" in item
+    )
+}
+
+# Records larger than this have their payload fields cut down to a preview
+MAX_RECORD_BYTES = int(os.getenv("ARCHIVE_MAX_RECORD_BYTES", str(256 * 1024)))
+PAYLOAD_FIELDS = ("json", "body", "response")
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+_buffers = {}  # folder -> list of NDJSON lines
+_buffered_records = 0
+_buffered_bytes = 0
+_dropped = 0
+_flusher = None
+
+
+def _start():
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_loop, daemon=True)
+        _flusher.start()
+
+
+def _flush_loop():
+    while True:
+        _wakeup.wait(FLUSH_INTERVAL)
+        _wakeup.clear()
+        flush()
+
+
+def sample_rate(endpoint):
+    """Returns the share of calls to an endpoint that are archived."""
+    return SAMPLE_RATES.get(endpoint, DEFAULT_SAMPLE_RATE)
+
+
+def is_sampled(endpoint):
+    """Decides whether a call to an endpoint is archived, at its sample rate."""
+    rate = sample_rate(endpoint)
+    return rate >= 1 or random.random() < rate
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+def serialize(record):
+    """Serializes a record as one compact JSON line of at most about MAX_RECORD_BYTES.
+
+    When the record is too large, its payload fields are replaced, largest
+    first, by their size and a preview of their JSON.
+
+    Returns:
+        str: The NDJSON line, without the newline.
+    """
+    line = _dumps(record)
+    if len(line) <= MAX_RECORD_BYTES:
+        return line
+
+    record = dict(record)
+    payloads = {field: _dumps(record[field]) for field in PAYLOAD_FIELDS if record.get(field) is not None}
+    for field in sorted(payloads, key=lambda field: len(payloads[field]), reverse=True):
+        record[field] = None
+        preview = payloads[field][:max(MAX_RECORD_BYTES - len(_dumps(record)), 0)]
+        while True:
+            record[field] = {"truncated": True, "bytes": len(payloads[field]), "preview": preview}
+            line = _dumps(record)
+            # Escaping makes the preview longer in JSON than in the payload
+            if len(line) <= MAX_RECORD_BYTES or not preview:
+                break
+            preview = preview[:len(preview) * 3 // 4]
+        if len(line) <= MAX_RECORD_BYTES:
+            break
+    return line
+
+
+def enqueue(folder, record):
+    """Buffers a record for the next batch of a folder; never blocks on GCS.
+
+    The record is serialized right away, so later changes to the objects it
+    refers to do not leak into the archive.
+
+    Args:
+        folder (str): Folder of the batch in ARCHIVE_BUCKET, e.g. "requests"
+        record (dict): JSON-serializable record
+    """
+    global _buffered_records, _buffered_bytes, _dropped
+    line = serialize(record)
+    with _lock:
+        if _buffered_records >= MAX_BUFFERED_RECORDS:
+            _dropped += 1
+            return
+        _buffers.setdefault(folder, []).append(line)
+        _buffered_records += 1
+        _buffered_bytes += len(line) + 1
+        full = _buffered_records >= FLUSH_RECORDS or _buffered_bytes >= FLUSH_BYTES
+        _start()
+    if full:
+        _wakeup.set()
+
+
+def _upload_batch(folder, lines):
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    short_uuid = str(uuid.uuid4())[:8]
+    blob = clients.get_bucket(ARCHIVE_BUCKET).blob(f"{folder}/batch_{timestamp}_{short_uuid}.ndjson")
+    blob.upload_from_string(
+        data="\n".join(lines) + "\n",
+        content_type='application/x-ndjson'
+    )
+
+
+def flush():
+    """Writes every buffered record to GCS, one NDJSON object per folder.
+
+    Batches that fail to upload are put back to be retried with the next flush.
+    """
+    global _buffers, _buffered_records, _buffered_bytes, _dropped
+    with _flush_lock:
+        with _lock:
+            buffers, _buffers = _buffers, {}
+            _buffered_records = 0
+            _buffered_bytes = 0
+            dropped, _dropped = _dropped, 0
+        if dropped:
+            print(f"Archive buffer full, dropped {dropped} records")
+
+        for folder, lines in buffers.items():
+            try:
+                _upload_batch(folder, lines)
+            except Exception as e:
+                print(f"Error archiving {len(lines)} records to {folder}: {str(e)}")
+                with _lock:
+                    _buffers[folder] = lines + _buffers.get(folder, [])
+                    _buffered_records += len(lines)
+                    _buffered_bytes += sum(len(line) + 1 for line in lines)
+
+
+# Cloud Functions sends SIGTERM before stopping an instance; the worker then
+# exits normally and writes out whatever is still buffered
+atexit.register(flush)
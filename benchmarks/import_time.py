@@ -0,0 +1,98 @@
+"""Reports the cold-start import cost of each endpoint.
+
+Every endpoint is measured in a fresh interpreter, so nothing is shared between
+runs: the time covers importing main plus resolving that endpoint's handler,
+which is what the first request to a new Cloud Functions instance pays for.
+
+Usage:
+    python benchmarks/import_time.py [--runs 5] [--top 10] [endpoint ...]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter and prints the elapsed milliseconds
+MEASURE = """
+import time
+started_at = time.perf_counter()
+import main
+if {endpoint!r}:
+    main.HANDLERS[{endpoint!r}].resolve()
+print((time.perf_counter() - started_at) * 1000)
+"""
+
+
+def measure(endpoint, runs):
+    """Imports main and one handler in `runs` fresh interpreters.
+
+    Args:
+        endpoint (str): Key of main.HANDLERS, or "" for main alone
+        runs (int): Number of interpreters to start
+
+    Returns:
+        list: Milliseconds taken by each run.
+    """
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", MEASURE.format(endpoint=endpoint)],
+            cwd=REPO_ROOT, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def top_imports(endpoint, top):
+    """Returns the slowest modules imported for an endpoint, from python -X importtime.
+
+    Returns:
+        list: (cumulative microseconds, module name) tuples, slowest first.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", MEASURE.format(endpoint=endpoint)],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Only top level imports, nested ones are already in their parent's total
+        if not name.startswith("  "):
+            modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    sys.path.insert(0, REPO_ROOT)
+    import main as app
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("endpoints", nargs="*", default=[""] + list(app.HANDLERS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0, help="Also list the slowest imports of each endpoint")
+    args = parser.parse_args()
+
+    print(f"{'endpoint':<18}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for endpoint in args.endpoints:
+        label = endpoint or "(main only)"
+        try:
+            timings = measure(endpoint, args.runs)
+        except RuntimeError as e:
+            print(f"{label:<18}failed: {e}")
+            continue
+        print(f"{label:<18}{statistics.median(timings):>12.1f}{min(timings):>10.1f}{max(timings):>10.1f}")
+        if args.top:
+            for cumulative, name in top_imports(endpoint, args.top):
+                print(f"{'':<20}{cumulative / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
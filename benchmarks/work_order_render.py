@@ -0,0 +1,65 @@
+"""Times work order HTML rendering for growing numbers of line items.
+
+Rendering should scale linearly: the per item time stays flat as orders grow.
+
+Usage:
+    python benchmarks/work_order_render.py [--runs 5] [sizes ...]
+"""
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import work_order_template
+
+
+def sample_order(line_item_count):
+    """Builds an order with `line_item_count` line items in the work order input format."""
+    return {
+        "name": "Benchmark Campaign",
+        "sourceOrderId": "BENCH-1",
+        "startDate": "2025-01-01",
+        "endDate": "2025-03-31",
+        "advertiserId": 1,
+        "salesPersonName": "Sales Person",
+        "salesPersonEmailId": "sales@example.com",
+        "lineitems": [
+            {
+                "name": f"Line item {i}",
+                "productName": "DOOH Field Signage",
+                "quantity": 100000 + i,
+                "costType": "CPM",
+                "unitCost": 12.5,
+                "startDate": "2025-01-01",
+                "endDate": "2025-03-31"
+            }
+            for i in range(line_item_count)
+        ]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sizes", nargs="*", type=int, default=[10, 100, 1000, 10000])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    created = datetime.datetime.now()
+    print(f"{'line items':>10}{'median ms':>12}{'us / item':>12}{'html KB':>10}")
+    for size in args.sizes:
+        order = sample_order(size)
+        timings = []
+        for _ in range(args.runs):
+            started_at = time.perf_counter()
+            html_content = work_order_template.render_work_order_html(order, created=created)
+            timings.append((time.perf_counter() - started_at) * 1000)
+        median = statistics.median(timings)
+        print(f"{size:>10}{median:>12.2f}{median * 1000 / max(size, 1):>12.2f}{len(html_content) / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import os
+import threading
+
+# Connection pool sizes for the shared clients. Cloud Functions reuses the
+# process between warm invocations, so these pools stay open across requests.
+POOL_CONNECTIONS = int(os.getenv("CLIENT_POOL_CONNECTIONS", "10"))
+POOL_MAXSIZE = int(os.getenv("CLIENT_POOL_MAXSIZE", "20"))
+
+_lock = threading.Lock()
+_bigquery_client = None
+_storage_client = None
+
+
+def bigquery_module():
+    """Imports google.cloud.bigquery on first use, keeping it off the cold start of endpoints that never query."""
+    from google.cloud import bigquery
+    return bigquery
+
+
+def storage_module():
+    """Imports google.cloud.storage on first use."""
+    from google.cloud import storage
+    return storage
+
+
+def _mount_pool(client):
+    """Replace the default HTTP adapter of a Google client with a sized connection pool.
+
+    Args:
+        client: A google.cloud client exposing the authorized session as `_http`.
+
+    Returns:
+        The same client, for chaining.
+    """
+    from requests.adapters import HTTPAdapter
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    client._http.mount("https://", adapter)
+    return client
+
+
+def get_bigquery_client():
+    """Returns the process-wide BigQuery client, creating it on first use.
+
+    Returns:
+        bigquery.Client: The shared client.
+    """
+    global _bigquery_client
+    if _bigquery_client is None:
+        with _lock:
+            if _bigquery_client is None:
+                _bigquery_client = _mount_pool(bigquery_module().Client())
+    return _bigquery_client
+
+
+def get_storage_client():
+    """Returns the process-wide Cloud Storage client, creating it on first use.
+
+    Returns:
+        storage.Client: The shared client.
+    """
+    global _storage_client
+    if _storage_client is None:
+        with _lock:
+            if _storage_client is None:
+                _storage_client = _mount_pool(storage_module().Client())
+    return _storage_client
+
+
+def get_bucket(bucket_name):
+    """Returns a bucket handle bound to the shared Cloud Storage client.
+
+    Args:
+        bucket_name (str): Name of the GCS bucket.
+
+    Returns:
+        storage.Bucket: The bucket handle.
+    """
+    return get_storage_client().bucket(bucket_name)
@@ -0,0 +1,63 @@
+import csv
+import io
+import zlib
+
+
+class CsvStream:
+    """Read-only file-like object that renders CSV rows on demand.
+
+    Rows are pulled from the generator only as the reader asks for bytes, so
+    the whole file never sits in memory or on disk. Suitable for
+    ftplib.FTP.storbinary and other consumers that call read(blocksize).
+
+    Args:
+        fieldnames (list): CSV header, written first
+        rows (iterable): Row dicts keyed by fieldnames
+        compress (bool): Gzip-compress the output on the fly
+    """
+
+    def __init__(self, fieldnames, rows, compress=False):
+        self._rows = iter(rows)
+        self._text = io.StringIO()
+        self._writer = csv.DictWriter(self._text, fieldnames=fieldnames)
+        self._writer.writeheader()
+        self._compressor = zlib.compressobj(wbits=31) if compress else None
+        self._buffer = bytearray()
+        self._finished = False
+        self.bytes_read = 0
+
+    def _fill(self, size):
+        # Render rows until the buffer holds size bytes or the rows run out
+        while not self._finished and (size < 0 or len(self._buffer) < size):
+            for row in self._rows:
+                self._writer.writerow(row)
+                if self._text.tell() >= 64 * 1024:
+                    break
+            else:
+                self._finished = True
+
+            data = self._text.getvalue().encode("utf-8")
+            self._text.seek(0)
+            self._text.truncate()
+            if self._compressor:
+                data = self._compressor.compress(data)
+                if self._finished:
+                    data += self._compressor.flush()
+            self._buffer += data
+
+    def read(self, size=-1):
+        """Returns up to size bytes of CSV, or b"" once every row has been read."""
+        self._fill(size)
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.bytes_read += len(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._finished = True
+        self._buffer.clear()
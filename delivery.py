@@ -1,16 +1,234 @@
-import csv
+import aos_auth
+import aos_client
+from cache import TTLCache
+from csv_stream import CsvStream
 import json
 import os
-from google.cloud import bigquery
+import clients
+import delivery_writer
 import datetime
-import random
-from google.cloud import secretmanager
+import itertools
+import job_queue
+import numpy as np
 import ftplib
-import requests
 import base64
 
+# Production system id by name, per (environment, api key)
+production_system_cache = TTLCache(maxsize=256, ttl=int(os.getenv("AOS_PS_DEFINITION_TTL", "3600")))
+
+DELIVERY_TABLE = "aos-demo-toolkit.delivery.primary_delivery"
+
+# Flight and quantity the delivery rows of each line item were generated for,
+# and whether those rows still have to be sent to AOS in a delivery pull
+WATERMARK_TABLE = "aos-demo-toolkit.delivery.delivery_watermarks"
+WATERMARK_SCHEMA = """
+    line_item_id INT64 NOT NULL,
+    start_date DATETIME,
+    end_date DATETIME,
+    quantity INT64,
+    pull_pending BOOL,
+    updated_at TIMESTAMP
+"""
+
+# Seconds before retrying a delete of rows that are still in the streaming buffer
+STREAMING_BUFFER_RETRY_DELAY = 600
+
+# Set DELIVERY_CSV_GZIP=1 to upload the delivery pull CSV gzip-compressed
+GZIP_CSV = os.getenv("DELIVERY_CSV_GZIP") == "1"
+
+# BigQuery column and CSV header of every delivery field, in CSV order
+DELIVERY_FIELDS = [
+    ("delivered_date", "Delivered Date"),
+    ("advertiser_id", "Advertiser ID"),
+    ("advertiser_name", "Advertiser Name"),
+    ("order_id", "Order ID"),
+    ("order_name", "Order Name"),
+    ("line_item_id", "Line Item ID"),
+    ("line_item_name", "Line Item Name"),
+    ("line_item_start_date", "Line Item Start Date"),
+    ("line_item_end_date", "Line Item End Date"),
+    ("line_item_delivered_quantity_1", "Line Item Delivered Quantity 1"),
+    ("line_item_unit_type_1", "Line Item Unit Type 1"),
+    ("line_item_delivered_quantity_2", "Line Item Delivered Quantity 2"),
+    ("line_item_unit_type_2", "Line Item Unit Type 2"),
+    ("line_item_delivered_quantity_3", "Line Item Delivered Quantity 3"),
+    ("line_item_unit_type_3", "Line Item Unit Type 3"),
+]
+CSV_HEADERS = [header for _, header in DELIVERY_FIELDS]
+
+class DeliveryColumns:
+    """Day-by-day delivery of an order's line items, held as NumPy columns.
+
+    Each line item is expanded into one position per flight day with a random
+    factor between -10% and +10% applied to its even daily share. BigQuery
+    rows and CSV rows are both produced lazily from the same columns.
+
+    Args:
+        order_id (int): ID of the order
+        line_items (list): Line item dicts with line_item_id, line_item_name, start_date,
+            end_date, quantity, advertiser_id, advertiser_name and order_name.
+    """
+
+    def __init__(self, order_id, line_items):
+        self.order_id = order_id
+        self.line_items = line_items
+
+        rng = np.random.default_rng()
+        dates = [np.array([], dtype='datetime64[D]')]
+        impressions = [np.array([])]
+        offsets = [0]
+        for line_item in line_items:
+            days = max((line_item['end_date'] - line_item['start_date']).days + 1, 0)
+            base_quantity_per_day = line_item['quantity'] / days if days else 0
+            dates.append(np.datetime64(line_item['start_date'].date(), 'D') + np.arange(days))
+            impressions.append(np.round(base_quantity_per_day * rng.uniform(0.9, 1.1, days)))
+            offsets.append(offsets[-1] + days)
+
+        self.offsets = offsets  # Line item i covers positions offsets[i]:offsets[i + 1]
+        self.delivered_date = np.datetime_as_string(np.concatenate(dates))
+        self.quantity_1 = np.concatenate(impressions).astype(np.int64)
+        self.quantity_2 = np.round(self.quantity_1 * .1).astype(np.int64)
+        self.quantity_3 = np.round(self.quantity_1 * .01).astype(np.int64)
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def iter_values(self):
+        """Yields the field values of each delivery day, in DELIVERY_FIELDS order."""
+        for i, line_item in enumerate(self.line_items):
+            start, end = self.offsets[i], self.offsets[i + 1]
+            fixed = (
+                line_item['advertiser_id'],
+                line_item['advertiser_name'],
+                self.order_id,
+                line_item['order_name'],
+                line_item['line_item_id'],
+                line_item['line_item_name'],
+                line_item['start_date'].strftime('%Y-%m-%d'),
+                line_item['end_date'].strftime('%Y-%m-%d'),
+            )
+            for delivered_date, quantity_1, quantity_2, quantity_3 in zip(
+                self.delivered_date[start:end].tolist(),
+                self.quantity_1[start:end].tolist(),
+                self.quantity_2[start:end].tolist(),
+                self.quantity_3[start:end].tolist()
+            ):
+                yield (delivered_date,) + fixed + (
+                    quantity_1, "impressions",
+                    quantity_2, "actions",
+                    quantity_3, "clicks",
+                )
+
+    def iter_rows(self, inserted_at):
+        """Yields primary_delivery rows for BigQuery."""
+        for values in self.iter_values():
+            row = {field: value for (field, _), value in zip(DELIVERY_FIELDS, values)}
+            row["inserted_at"] = inserted_at
+            yield row
+
+    def iter_csv_rows(self):
+        """Yields rows for the delivery pull CSV, keyed by CSV_HEADERS."""
+        for values in self.iter_values():
+            yield dict(zip(CSV_HEADERS, values))
+
+def needs_regeneration(line_item):
+    """Whether a line item is new or its flight or quantity changed since its rows were generated."""
+    watermark = (line_item['watermark_start_date'], line_item['watermark_end_date'], line_item['watermark_quantity'])
+    return watermark != (line_item['start_date'], line_item['end_date'], line_item['quantity'])
+
+def delete_delivery_rows(client, line_item_ids):
+    """Deletes the delivery rows of line items that are about to be regenerated.
+
+    Rows streamed in the last ~90 minutes cannot be deleted yet; the job is
+    then retried later through job_queue.NotReady.
+    """
+    bigquery = clients.bigquery_module()
+    query = f"""
+    DELETE FROM `{DELIVERY_TABLE}`
+    WHERE line_item_id IN UNNEST(@line_item_ids)
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("line_item_ids", "INT64", line_item_ids)]
+    )
+    try:
+        client.query(query, job_config=job_config).result()
+    except Exception as e:
+        if "streaming buffer" in str(e):
+            raise job_queue.NotReady(f"Delivery rows of line items {line_item_ids} are still in the streaming buffer", delay=STREAMING_BUFFER_RETRY_DELAY)
+        raise
+
+def update_watermarks(client, line_items):
+    """Records the flight and quantity the line items' rows were generated for, with their pull still pending."""
+    bigquery = clients.bigquery_module()
+    watermarks = [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter("line_item_id", "INT64", line_item['line_item_id']),
+            bigquery.ScalarQueryParameter("start_date", "DATETIME", line_item['start_date']),
+            bigquery.ScalarQueryParameter("end_date", "DATETIME", line_item['end_date']),
+            bigquery.ScalarQueryParameter("quantity", "INT64", line_item['quantity']),
+        )
+        for line_item in line_items
+    ]
+    query = f"""
+    MERGE `{WATERMARK_TABLE}` AS target
+    USING UNNEST(@watermarks) AS source
+    ON target.line_item_id = source.line_item_id
+    WHEN MATCHED THEN
+        UPDATE SET start_date = source.start_date,
+            end_date = source.end_date,
+            quantity = source.quantity,
+            pull_pending = TRUE,
+            updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+        INSERT (line_item_id, start_date, end_date, quantity, pull_pending, updated_at)
+        VALUES (source.line_item_id, source.start_date, source.end_date, source.quantity, TRUE, CURRENT_TIMESTAMP())
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("watermarks", "STRUCT", watermarks)]
+    )
+    client.query(query, job_config=job_config).result()
+
+def mark_pulled(client, line_item_ids):
+    """Records that the delivery rows of the line items were sent to AOS."""
+    bigquery = clients.bigquery_module()
+    query = f"""
+    UPDATE `{WATERMARK_TABLE}`
+    SET pull_pending = FALSE, updated_at = CURRENT_TIMESTAMP()
+    WHERE line_item_id IN UNNEST(@line_item_ids)
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("line_item_ids", "INT64", line_item_ids)]
+    )
+    client.query(query, job_config=job_config).result()
+
+def iter_stored_csv_rows(client, line_item_ids):
+    """Yields delivery pull CSV rows from the rows already stored for the line items."""
+    bigquery = clients.bigquery_module()
+    query = f"""
+    SELECT {", ".join(field for field, _ in DELIVERY_FIELDS)}
+    FROM `{DELIVERY_TABLE}`
+    WHERE line_item_id IN UNNEST(@line_item_ids)
+    ORDER BY line_item_id, delivered_date
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("line_item_ids", "INT64", line_item_ids)]
+    )
+    for row in client.query(query, job_config=job_config).result():
+        yield {header: row[field] for field, header in DELIVERY_FIELDS}
+
+def count_line_items(order_id):
+    """Returns how many line items of an order are visible in BigQuery."""
+    client = clients.get_bigquery_client()
+    query = f"""
+    SELECT COUNT(*) AS line_item_count
+    FROM `aos-demo-toolkit.orders.line_items`
+    WHERE order_id = {int(order_id)}
+    """
+    return next(client.query(query).result())["line_item_count"]
+
 def generate_delivery_data(order_id, basic_auth):
-    client = bigquery.Client()
+    client = clients.get_bigquery_client()
 
     # Decode the basic_auth parameter
     encoded_auth = basic_auth.split(" ")[1]
@@ -21,8 +239,10 @@ def generate_delivery_data(order_id, basic_auth):
     api_pass, api_key, ftp_pass = password_info.split('||')
     print(f"API Password: {api_pass}, API Key: {api_key}, FTP Password: {ftp_pass}")
 
-    # Query to get the line item details
+    # Query to get the line item details; the watermark table is created on first use
     query = f"""
+    CREATE TABLE IF NOT EXISTS `{WATERMARK_TABLE}` ({WATERMARK_SCHEMA});
+
     SELECT
         line_items.id AS line_item_id,
         line_items.name AS line_item_name,
@@ -31,17 +251,24 @@ def generate_delivery_data(order_id, basic_auth):
         line_items.quantity,
         line_items.advertiser_id,
         advertisers.name AS advertiser_name,
-        orders.name AS order_name
+        orders.name AS order_name,
+        watermarks.start_date AS watermark_start_date,
+        watermarks.end_date AS watermark_end_date,
+        watermarks.quantity AS watermark_quantity,
+        IFNULL(watermarks.pull_pending, FALSE) AS pull_pending
     FROM `aos-demo-toolkit.orders.line_items` AS line_items
     JOIN `aos-demo-toolkit.orders.advertisers` AS advertisers
     ON line_items.advertiser_id = advertisers.id
     JOIN `aos-demo-toolkit.orders.orders` AS orders
     ON line_items.order_id = orders.id
+    LEFT JOIN `{WATERMARK_TABLE}` AS watermarks
+    ON watermarks.line_item_id = line_items.id
     WHERE line_items.order_id = {order_id}
     """
     query_job = client.query(query)
     results = query_job.result()
-    line_items = []
+    changed_line_items = []
+    pending_line_items = []
     for row in results:
         line_item = {
             "line_item_id": row.line_item_id,
@@ -51,163 +278,139 @@ def generate_delivery_data(order_id, basic_auth):
             "advertiser_id": row.advertiser_id,
             "advertiser_name": row.advertiser_name,
             "order_name": row.order_name,
-            "quantity": row.quantity
+            "quantity": row.quantity,
+            "watermark_start_date": row.watermark_start_date,
+            "watermark_end_date": row.watermark_end_date,
+            "watermark_quantity": row.watermark_quantity
         }
-        line_items.append(line_item)
-
-    table_id = "aos-demo-toolkit.delivery.primary_delivery"
-
-    rows_to_insert = []
-    csv_rows = []
-
-    current_timestamp = datetime.datetime.now().isoformat()  # Convert to ISO 8601 string
-
-    for line_item in line_items:
-        start_date = line_item['start_date']
-        end_date = line_item['end_date']
-        delta = end_date - start_date
-
-        for i in range(delta.days + 1):
-            delivered_date = start_date + datetime.timedelta(days=i)
-            # Calculate the delivered quantity per day
-            base_quantity_per_day = line_item['quantity'] / (delta.days + 1)
-            # Apply a random factor between -10% and +10%
-            random_factor = random.uniform(0.9, 1.1)
-            delivered_quantity = round(base_quantity_per_day * random_factor)
-            row = {
-                "delivered_date": delivered_date.strftime('%Y-%m-%d'),
-                "advertiser_id": line_item['advertiser_id'],
-                "advertiser_name": line_item['advertiser_name'],
-                "order_id": order_id,
-                "order_name": line_item['order_name'],
-                "line_item_id": line_item['line_item_id'],
-                "line_item_name": line_item['line_item_name'],
-                "line_item_start_date": start_date.strftime('%Y-%m-%d'),
-                "line_item_end_date": end_date.strftime('%Y-%m-%d'),
-                "line_item_delivered_quantity_1": delivered_quantity,
-                "line_item_unit_type_1": "impressions",
-                "line_item_delivered_quantity_2": round(delivered_quantity * .1),
-                "line_item_unit_type_2": "actions",
-                "line_item_delivered_quantity_3": round(delivered_quantity * .01),
-                "line_item_unit_type_3": "clicks",
-                "inserted_at": current_timestamp
-            }
-            csv_row = {
-                "Delivered Date": delivered_date.strftime('%Y-%m-%d'),
-                "Advertiser ID": line_item['advertiser_id'],
-                "Advertiser Name": line_item['advertiser_name'],
-                "Order ID": order_id,
-                "Order Name": line_item['order_name'],
-                "Line Item ID": line_item['line_item_id'],
-                "Line Item Name": line_item['line_item_name'],
-                "Line Item Start Date": start_date.strftime('%Y-%m-%d'),
-                "Line Item End Date": end_date.strftime('%Y-%m-%d'),
-                "Line Item Delivered Quantity 1": delivered_quantity,
-                "Line Item Unit Type 1": "impressions",
-                "Line Item Delivered Quantity 2": round(delivered_quantity * .1),
-                "Line Item Unit Type 2": "actions",
-                "Line Item Delivered Quantity 3": round(delivered_quantity * .01),
-                "Line Item Unit Type 3": "clicks",
-            }
-            rows_to_insert.append(row)
-            csv_rows.append(csv_row)
-
-    errors = client.insert_rows_json(table_id, rows_to_insert)
-
-    # Ensure the /tmp directory exists
-    tmp_dir = "/tmp"
-    if not os.path.exists(tmp_dir):
-        os.makedirs(tmp_dir)
-
-    # Generate CSV file
-    today_date = datetime.datetime.now().strftime('%Y-%m-%d')
-    csv_filename = f"Operative_DeliveryPull_{today_date}.csv"
-    csv_file_path = os.path.join(tmp_dir, csv_filename)  # Use /tmp directory for Cloud Run
-    
-    with open(csv_file_path, mode='w', newline='') as csv_file:
-        writer = csv.DictWriter(csv_file, fieldnames=csv_rows[0].keys())
-        writer.writeheader()
-        for row in csv_rows:
-            writer.writerow(row)
-    
-    with ftplib.FTP(ftp_host) as ftp:
-        ftp.login(user=ftp_user, passwd=ftp_pass)
-        ftp.cwd(ftp_folder)  # Change to the specified folder
-        with open(csv_file_path, 'rb') as file:
-            ftp.storbinary(f'STOR {csv_filename}', file)
+        # New or changed line items are regenerated; the rest only need a pull that failed before
+        if needs_regeneration(line_item):
+            changed_line_items.append(line_item)
+        elif row.pull_pending:
+            pending_line_items.append(line_item)
 
-    if errors:
-        print(f"Encountered errors while inserting rows: {errors}")
-    else:
-        print("Primary delivery rows have been successfully inserted.")
-        trigger_pull_api(csv_filename, api_user, api_pass, api_key, api_tenant_name, production_system_name)
+    if not changed_line_items and not pending_line_items:
+        print(f"Delivery for order {order_id} is up to date")
+        return f"Delivery data for order {order_id} is already up to date."
 
-    # Clean up the temporary CSV file
-    os.remove(csv_file_path)
+    delivery_columns = DeliveryColumns(order_id, changed_line_items)
+    if changed_line_items:
+        print(f"Generating {len(delivery_columns)} delivery days for {len(changed_line_items)} new or changed line items")
+        current_timestamp = datetime.datetime.now().isoformat()  # Convert to ISO 8601 string
 
-    return f"Primary delivery data has been generated and uploaded to FTP server."
+        # Replace the rows generated for an earlier flight or quantity, or by a failed attempt
+        delete_delivery_rows(client, [line_item['line_item_id'] for line_item in changed_line_items])
 
-def trigger_pull_api(filename, api_user, api_pass, api_key, api_tenant_name, production_system_name):
-    environment = os.getenv("ENVIRONMENT")
-    print(f"ENVIRONMENT: {environment}")
+        # Stream the rows in concurrent chunks, retrying failed rows
+        errors = delivery_writer.write_rows(
+            DELIVERY_TABLE,
+            delivery_columns.iter_rows(current_timestamp),
+            row_count=len(delivery_columns),
+            row_id=lambda row: f"{row['line_item_id']}-{row['delivered_date']}-{row['inserted_at']}"
+        )
+        if errors:
+            # The job is retried, deleting and rewriting these line items' rows
+            raise RuntimeError(f"{len(errors)} delivery rows of order {order_id} could not be inserted: {errors[:3]}")
+        print("Primary delivery rows have been successfully inserted.")
 
-    api_mayiservice = "https://staging-api.aos.operative.com/mayiservice/tenant/"
-    api_envurl = "aos-stg-gw.operativeone.com"
+        # From here on a retry resumes with the pull instead of inserting the rows again
+        update_watermarks(client, changed_line_items)
+
+    # Fresh rows come from memory; rows of an earlier failed pull are read back
+    csv_rows = delivery_columns.iter_csv_rows()
+    if pending_line_items:
+        print(f"Resending {len(pending_line_items)} line items whose delivery pull did not complete")
+        csv_rows = itertools.chain(csv_rows, iter_stored_csv_rows(client, [line_item['line_item_id'] for line_item in pending_line_items]))
 
-    # Construct the URL for the mayiservice
-    url = f"{api_mayiservice}{api_tenant_name}"
-    print(f"Mayiservice URL: {url}")
+    # Stream the CSV straight to the FTP server as it is rendered
+    today_date = datetime.datetime.now().strftime('%Y-%m-%d')
+    csv_filename = f"Operative_DeliveryPull_{today_date}.csv"
+    if GZIP_CSV:
+        csv_filename += ".gz"
+    csv_file = CsvStream(CSV_HEADERS, csv_rows, compress=GZIP_CSV)
+
+    with ftplib.FTP(ftp_host) as ftp:
+        ftp.login(user=ftp_user, passwd=ftp_pass)
+        ftp.cwd(ftp_folder)  # Change to the specified folder
+        ftp.storbinary(f'STOR {csv_filename}', csv_file)
+    print(f"Uploaded {csv_file.bytes_read} bytes to {ftp_host}/{ftp_folder}/{csv_filename}")
 
-    payload = {
-        "expiration": 360,
-        "password": api_pass,
-        "userId": api_user,
-        "apiKey": api_key
-    }
+    trigger_pull_api(csv_filename, api_user, api_pass, api_key, api_tenant_name, production_system_name)
+    mark_pulled(client, [line_item['line_item_id'] for line_item in changed_line_items + pending_line_items])
 
-    # Make the POST request to get the bearer token
-    response = requests.post(url, json=payload)
-    response.raise_for_status()  # Raise an exception for HTTP errors
+    return f"Primary delivery data has been generated and uploaded to FTP server."
 
-    # Extract the token from the JSON response
-    token = response.json().get("token")
-    print(f"Bearer Token: {token}")
+def fetch_production_systems(api_envurl, api_key, token):
+    """Downloads the tenant's psDefinition list and indexes it by production system name.
 
+    Returns:
+        dict: Production system id by name.
+    """
     # Construct the URL for the GET request to get the production_system_id
     get_url = f"https://{api_envurl}/mdm/v1/{api_key}/psDefinition"
     print(f"GET URL: {get_url}")
 
     # Make the GET request to get the production_system_id
     headers = {"Authorization": f"Bearer {token}"}
-    get_response = requests.get(get_url, headers=headers)
-    get_response.raise_for_status()  # Raise an exception for HTTP errors
+    get_response = aos_client.get("psDefinition", get_url, headers=headers)
+
+    return {item["name"]: item["id"] for item in get_response.json()}
+
+def get_production_system_id(api_envurl, api_key, token, production_system_name):
+    """Returns the id of a production system, refetching psDefinition only when the cache misses.
+
+    Returns:
+        str: The production system id, or None if the tenant has no such production system.
+    """
+    key = (api_envurl, api_key)
+    production_systems = production_system_cache.get(key)
+    if production_systems is None or production_system_name not in production_systems:
+        # Unknown names may have been added since the list was cached
+        production_systems = fetch_production_systems(api_envurl, api_key, token)
+        production_system_cache.set(key, production_systems)
+    return production_systems.get(production_system_name)
 
-    # Extract the production_system_id from the JSON response
-    ps_definitions = get_response.json()
-    production_system_id = next((item["id"] for item in ps_definitions if item["name"] == production_system_name), None)
-    print(f"Production System ID: {production_system_id}")
+def invalidate_production_systems(api_envurl=None, api_key=None):
+    """Drops the cached psDefinition index of one tenant, or of every tenant when called without arguments."""
+    if api_envurl is None and api_key is None:
+        production_system_cache.invalidate()
+    else:
+        production_system_cache.invalidate((api_envurl, api_key))
+
+def trigger_pull_api(filename, api_user, api_pass, api_key, api_tenant_name, production_system_name):
+    environment = os.getenv("ENVIRONMENT")
+    print(f"ENVIRONMENT: {environment}")
+
+    api_mayiservice = "https://staging-api.aos.operative.com/mayiservice/tenant/"
+    api_envurl = "aos-stg-gw.operativeone.com"
 
     # Read the payload template from the JSON file
     with open("delivery_pull_trigger_payload.json", "r") as f:
         post_payload_template = f.read()
 
-    # Replace placeholders with actual values
-    today_date = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.0')
-    end_date = "2025-12-24T12:10:00.0"
-    post_payload = post_payload_template.replace("PRODUCTION_SYSTEM_ID", production_system_id)
-    post_payload = post_payload.replace("TODAYS_DATE", today_date)
-    post_payload = post_payload.replace("END_DATE", end_date)
-
-    # Convert the modified payload back to a dictionary
-    post_payload_dict = json.loads(post_payload)
-
     # Construct the URL for the POST request to trigger the delivery pull
     post_url = f"https://{api_envurl}/ingress/v2/{api_key}/ingest/inlinePayload"
     print(f"POST URL: {post_url}")
 
-    # Make the POST request to trigger the delivery pull
-    post_response = requests.post(post_url, json=post_payload_dict, headers=headers)
-    post_response.raise_for_status()  # Raise an exception for HTTP errors
+    def post_ingest(token):
+        # Resolve the production_system_id, from the cache when possible
+        headers = {"Authorization": f"Bearer {token}"}
+        production_system_id = get_production_system_id(api_envurl, api_key, token, production_system_name)
+        print(f"Production System ID: {production_system_id}")
+
+        # Replace placeholders with actual values
+        today_date = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.0')
+        end_date = "2025-12-24T12:10:00.0"
+        post_payload = post_payload_template.replace("PRODUCTION_SYSTEM_ID", production_system_id)
+        post_payload = post_payload.replace("TODAYS_DATE", today_date)
+        post_payload = post_payload.replace("END_DATE", end_date)
+
+        # Make the POST request to trigger the delivery pull
+        return aos_client.post("ingest", post_url, json=json.loads(post_payload), headers=headers)
+
+    # Reuse a cached bearer token while it is valid, fetching a new one if AOS rejects it
+    post_response = aos_auth.call_with_token(post_ingest, api_mayiservice, api_tenant_name, api_user, api_pass, api_key)
+    print(f"AOS API metrics: {aos_client.get_metrics()}")
 
     job_id = post_response.json().get("jobId")
 
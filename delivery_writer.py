@@ -0,0 +1,131 @@
+import clients
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import json
+import os
+import random
+import time
+
+# Streaming insert request bounds, kept well under the BigQuery limits
+CHUNK_ROWS = int(os.getenv("DELIVERY_INSERT_CHUNK_ROWS", "500"))
+CHUNK_BYTES = int(os.getenv("DELIVERY_INSERT_CHUNK_BYTES", str(5 * 1024 * 1024)))
+WORKERS = int(os.getenv("DELIVERY_INSERT_WORKERS", "4"))
+MAX_ATTEMPTS = int(os.getenv("DELIVERY_INSERT_ATTEMPTS", "4"))
+
+# Row counts above this are written with a load job instead of streaming inserts
+LOAD_JOB_THRESHOLD = int(os.getenv("DELIVERY_LOAD_JOB_THRESHOLD", "100000"))
+
+
+def iter_chunks(rows):
+    """Groups rows into lists bounded by CHUNK_ROWS rows and roughly CHUNK_BYTES of JSON.
+
+    Args:
+        rows (iterable): Row dicts.
+
+    Yields:
+        list: The next chunk of rows.
+    """
+    chunk, chunk_bytes = [], 0
+    for row in rows:
+        row_bytes = len(json.dumps(row))
+        if chunk and (len(chunk) >= CHUNK_ROWS or chunk_bytes + row_bytes > CHUNK_BYTES):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(row)
+        chunk_bytes += row_bytes
+    if chunk:
+        yield chunk
+
+
+def insert_chunk(client, table_id, rows, row_ids=None):
+    """Streams one chunk, retrying only the rows that failed, with exponential backoff.
+
+    Args:
+        client (bigquery.Client): The BigQuery client
+        table_id (str): Destination table
+        rows (list): The rows of the chunk
+        row_ids (list): Insert ids of the rows. Every attempt sends the same ids,
+            so BigQuery drops rows of a failed-looking request that did land.
+
+    Returns:
+        list: insert_rows_json style errors of the rows that still failed.
+    """
+    pending = rows
+    pending_ids = row_ids
+    errors = []
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            time.sleep((2 ** attempt) * 0.5 + random.uniform(0, 0.5))
+        try:
+            errors = client.insert_rows_json(table_id, pending, row_ids=pending_ids)
+        except Exception as e:
+            # The whole request failed, e.g. a timeout or a 5xx
+            errors = [{"index": i, "errors": [{"message": str(e)}]} for i in range(len(pending))]
+        if not errors:
+            return []
+        failed = [error["index"] for error in errors]
+        pending = [pending[i] for i in failed]
+        if pending_ids is not None:
+            pending_ids = [pending_ids[i] for i in failed]
+        print(f"Retrying {len(pending)} of {len(rows)} rows for {table_id}")
+    return errors
+
+
+def load_rows(client, table_id, rows):
+    """Appends rows with a single load job, for volumes too large to stream.
+
+    Returns:
+        list: The load job errors, if any.
+    """
+    bigquery = clients.bigquery_module()
+    job_config = bigquery.LoadJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+    load_job = client.load_table_from_json(list(rows), table_id, job_config=job_config)
+    try:
+        load_job.result()
+    except Exception as e:
+        return load_job.errors or [{"errors": [{"message": str(e)}]}]
+    return []
+
+
+def write_rows(table_id, rows, row_count=None, row_id=None):
+    """Writes rows to a BigQuery table in concurrent, size-bounded streaming inserts.
+
+    Args:
+        table_id (str): Destination table
+        rows (iterable): Row dicts; consumed lazily, so a generator keeps memory flat.
+        row_count (int): Number of rows if known; above LOAD_JOB_THRESHOLD a load job is used.
+        row_id (callable): Returns a stable insert id for a row, used for
+            deduplication when a streaming insert is retried.
+
+    Returns:
+        list: Errors of the rows that could not be written.
+    """
+    client = clients.get_bigquery_client()
+    started_at = time.monotonic()
+
+    if row_count is not None and row_count > LOAD_JOB_THRESHOLD:
+        errors = load_rows(client, table_id, rows)
+        # A load job is all or nothing
+        written = 0 if errors else row_count
+    else:
+        errors = []
+        written = 0
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            in_flight = {}
+            for chunk in iter_chunks(rows):
+                # Keep a bounded number of chunks in memory
+                if len(in_flight) >= WORKERS * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        errors.extend(future.result())
+                        written += in_flight.pop(future)
+                row_ids = [row_id(row) for row in chunk] if row_id else None
+                in_flight[executor.submit(insert_chunk, client, table_id, chunk, row_ids)] = len(chunk)
+            for future, size in in_flight.items():
+                errors.extend(future.result())
+                written += size
+        # Each remaining error is one row that was not written
+        written -= len(errors)
+
+    elapsed = max(time.monotonic() - started_at, 1e-6)
+    print(f"Wrote {written} rows to {table_id} in {elapsed:.2f}s ({written / elapsed:.0f} rows/sec, {len(errors)} errors)")
+    return errors
@@ -0,0 +1,128 @@
+import clients
+import os
+import random
+import threading
+import time
+
+# Small table holding the next free id of each sequence
+SEQUENCE_TABLE = "aos-demo-toolkit.orders.id_sequences"
+
+# Tables whose ids are handed out by this allocator, keyed by sequence name
+SEQUENCES = {
+    "advertisers": "aos-demo-toolkit.orders.advertisers",
+    "orders": "aos-demo-toolkit.orders.orders",
+    "line_items": "aos-demo-toolkit.orders.line_items",
+}
+
+# Number of ids reserved per round trip to BigQuery
+BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "50"))
+MAX_RESERVE_ATTEMPTS = 5
+
+_lock = threading.Lock()
+_blocks = {}  # sequence name -> [next_id, end_id) of the cached block
+
+
+def _reserve_block(sequence_name, block_size):
+    """Atomically reserves a block of ids in the sequence table.
+
+    The reservation runs in a BigQuery transaction, so two instances reserving
+    at the same time get disjoint blocks; the loser of a conflict is retried.
+    The sequence table is created if missing, and the first reservation of a
+    sequence seeds it from the current MAX(id).
+
+    Args:
+        sequence_name (str): Key of SEQUENCES
+        block_size (int): Number of ids to reserve
+
+    Returns:
+        int: The first id of the reserved block.
+    """
+    bigquery = clients.bigquery_module()
+    bigquery_client = clients.get_bigquery_client()
+    query = f"""
+    DECLARE block_start INT64;
+
+    -- DDL is not allowed inside the transaction; this is a no-op once the table exists
+    CREATE TABLE IF NOT EXISTS `{SEQUENCE_TABLE}` (
+        name STRING NOT NULL,
+        next_id INT64 NOT NULL
+    );
+
+    BEGIN TRANSACTION;
+
+    INSERT INTO `{SEQUENCE_TABLE}` (name, next_id)
+    SELECT @name, IFNULL(MAX(id), 0) + 1
+    FROM `{SEQUENCES[sequence_name]}`
+    WHERE NOT EXISTS (SELECT 1 FROM `{SEQUENCE_TABLE}` WHERE name = @name);
+
+    SET block_start = (SELECT next_id FROM `{SEQUENCE_TABLE}` WHERE name = @name);
+
+    UPDATE `{SEQUENCE_TABLE}`
+    SET next_id = next_id + @block_size
+    WHERE name = @name;
+
+    COMMIT TRANSACTION;
+
+    SELECT block_start;
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("name", "STRING", sequence_name),
+            bigquery.ScalarQueryParameter("block_size", "INT64", block_size),
+        ]
+    )
+
+    for attempt in range(MAX_RESERVE_ATTEMPTS):
+        try:
+            query_job = bigquery_client.query(query, job_config=job_config)
+            block_start = next(query_job.result())[0]
+            print(f"Reserved ids {block_start}-{block_start + block_size - 1} for {sequence_name}")
+            return block_start
+        except Exception as e:
+            # Concurrent reservations abort all but one transaction
+            if attempt == MAX_RESERVE_ATTEMPTS - 1:
+                raise
+            print(f"Id reservation for {sequence_name} failed, retrying: {str(e)}")
+            time.sleep((2 ** attempt) * 0.5 + random.uniform(0, 0.5))
+
+
+def allocate_ids(sequence_name, count):
+    """Hands out `count` unused ids, reserving new blocks only when the cached one runs out.
+
+    Ids are unique across instances but not gap-free: ids left in a block when
+    the process exits are never used.
+
+    Args:
+        sequence_name (str): One of "advertisers", "orders" or "line_items"
+        count (int): Number of ids needed
+
+    Returns:
+        list: The allocated ids in ascending order.
+    """
+    if sequence_name not in SEQUENCES:
+        raise ValueError(f"Unknown id sequence: {sequence_name}")
+
+    ids = []
+    with _lock:
+        while len(ids) < count:
+            next_id, end_id = _blocks.get(sequence_name, (0, 0))
+            if next_id >= end_id:
+                block_size = max(BLOCK_SIZE, count - len(ids))
+                next_id = _reserve_block(sequence_name, block_size)
+                end_id = next_id + block_size
+            take = min(count - len(ids), end_id - next_id)
+            ids.extend(range(next_id, next_id + take))
+            _blocks[sequence_name] = (next_id + take, end_id)
+    return ids
+
+
+def next_id(sequence_name):
+    """Hands out a single unused id.
+
+    Args:
+        sequence_name (str): One of "advertisers", "orders" or "line_items"
+
+    Returns:
+        int: The allocated id.
+    """
+    return allocate_ids(sequence_name, 1)[0]
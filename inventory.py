@@ -1,25 +1,37 @@
-from google.cloud import bigquery
-import datetime
+from cache import TTLCache
+import clients
+from concurrent.futures import ThreadPoolExecutor
+import inventory_engine
+import os
 import random
+import viewership_index
 
 
-def get_inventory_data(start_date, end_date, targets):
-    """Generates capacityCount, bookedCount, and availableCount for a date range.
+# Set INVENTORY_ENGINE=bigquery to run every forecast as a BigQuery job
+USE_LOCAL_ENGINE = os.getenv("INVENTORY_ENGINE", "local") != "bigquery"
+
+# Concurrent capacity computations of a batch request
+BATCH_WORKERS = int(os.getenv("INVENTORY_BATCH_WORKERS", "8"))
+
+# Bucket length in days of the breakdown query types
+BUCKET_DAYS = {"DAILY": 1, "WEEKLY": 7}
+
+# Capacity counts by normalized targeting; the booked/available split is not cached
+capacity_cache = TTLCache(
+    maxsize=int(os.getenv("INVENTORY_CACHE_SIZE", "5000")),
+    ttl=int(os.getenv("INVENTORY_CACHE_TTL", "600"))
+)
+
+
+def parse_targets(targets):
+    """Extracts unit length, genres and program types from the request targets.
 
     Args:
-        start_date (str): The start date in YYYY-MM-DD format.
-        end_date (str): The end date in YYYY-MM-DD format.
+        targets (list): The targets array of the inventory request.
 
     Returns:
-        tuple: A tuple containing capacityCount, bookedCount, and availableCount.
+        tuple: A tuple containing unit_length, genres and program_types.
     """
-
-    capacity_count = 0
-    booked_count = 0
-
-    # Get a reference to the BigQuery client and dataset
-    bigquery_client = bigquery.Client()
-    
     # Initialize variables
     unit_length = 30
     genres = []
@@ -40,13 +52,32 @@ def get_inventory_data(start_date, end_date, targets):
             # Extend the program_types list with targetValues
             program_types.extend(target_values)
 
-    # Now you have unit_length and genres extracted
-    print("Querying Inventory for the following parameters:")
-    print("Start Date:", start_date)
-    print("End Date:", end_date)
-    print("Unit Length:", unit_length)
-    print("Genres:", genres)
-    print("Program Types:", program_types)
+    return unit_length, genres, program_types
+
+
+def targeting_key(start_date, end_date, unit_length, genres, program_types):
+    """Builds a cache key that is the same for equivalent targeting in any order.
+
+    Returns:
+        tuple: The normalized date range, unit length, genres and program types.
+    """
+    return (
+        start_date,
+        end_date,
+        int(unit_length),
+        tuple(sorted(set(genres))),
+        tuple(sorted(set(program_types)))
+    )
+
+
+def query_view_factor_sum(unit_length, genres, program_types):
+    """Runs the break-level part of the inventory forecast as a BigQuery job.
+
+    Returns:
+        float: sum(view_factor) over the breaks matching the targeting.
+    """
+    # Get a reference to the BigQuery client and dataset
+    bigquery_client = clients.get_bigquery_client()
 
     # Construct the genre string for the WHERE clause
     if genres:
@@ -70,13 +101,7 @@ def get_inventory_data(start_date, end_date, targets):
     # Construct the BigQuery query
     query = f"""
     SELECT
-    CAST(sum(view_factor) * (
-        SELECT
-            sum(daily_viewership_forecast.viewers)
-        FROM
-            `aos-demo-toolkit.inventory.daily_viewership_forecast` AS daily_viewership_forecast
-        WHERE daily_viewership_forecast.date BETWEEN '{start_date}' AND '{end_date}'
-    ) AS INT64) AS total_viewers
+    sum(view_factor) AS view_factor_sum
 
     FROM (
     SELECT
@@ -101,9 +126,100 @@ def get_inventory_data(start_date, end_date, targets):
     results = query_job.result()
     try:
         first_row = next(results)
-        capacity_count = int(first_row[0])
+        return float(first_row[0] or 0)
     except StopIteration:
-        capacity_count = 0  # Or handle the case of no results
+        return 0.0  # Or handle the case of no results
+
+
+def get_view_factor_sum(unit_length, genres, program_types):
+    """Computes sum(view_factor) from the in-memory snapshot, falling back to BigQuery.
+
+    Returns:
+        float: sum(view_factor) over the breaks matching the targeting.
+    """
+    if USE_LOCAL_ENGINE:
+        try:
+            snapshot = inventory_engine.get_snapshot()
+            return snapshot.view_factor_sum(unit_length, genres, program_types)
+        except Exception as e:
+            print(f"Error using inventory snapshot, querying BigQuery instead: {str(e)}")
+    return query_view_factor_sum(unit_length, genres, program_types)
+
+
+def get_total_viewers(start_date, end_date, unit_length, genres, program_types):
+    """Computes the capacity for a date range and targeting.
+
+    The date range total comes from the in-memory viewership index, so only
+    the break-level view factor ever needs BigQuery.
+
+    Returns:
+        int: The total viewers for the date range and targeting.
+    """
+    view_factor_sum = get_view_factor_sum(unit_length, genres, program_types)
+    viewers = viewership_index.get_index().range_total(start_date, end_date)
+    return int(inventory_engine.round_half_away(view_factor_sum * viewers))
+
+
+def get_capacity(start_date, end_date, unit_length, genres, program_types):
+    """Returns the capacity for a date range and targeting, serving repeat avails checks from the cache.
+
+    Returns:
+        int: The capacity count.
+    """
+    key = targeting_key(start_date, end_date, unit_length, genres, program_types)
+    capacity_count = capacity_cache.get(key)
+    if capacity_count is None:
+        capacity_count = get_total_viewers(start_date, end_date, unit_length, genres, program_types)
+        capacity_cache.set(key, capacity_count)
+    return capacity_count
+
+
+def get_capacity_breakdown(start_date, end_date, unit_length, genres, program_types, query_type):
+    """Returns the capacity of every day or week of a date range, using the cache like get_capacity.
+
+    Returns:
+        list: (date string, capacity count) tuples in date order.
+    """
+    key = targeting_key(start_date, end_date, unit_length, genres, program_types) + (query_type,)
+    capacities = capacity_cache.get(key)
+    if capacities is None:
+        # The view factor is the same for every day, so only the viewers vary
+        view_factor_sum = get_view_factor_sum(unit_length, genres, program_types)
+        buckets = viewership_index.get_index().bucket_totals(start_date, end_date, BUCKET_DAYS[query_type])
+        capacities = [
+            (date.isoformat(), int(inventory_engine.round_half_away(view_factor_sum * viewers)))
+            for date, viewers in buckets
+        ]
+        capacity_cache.set(key, capacities)
+    return capacities
+
+
+def get_inventory_data(start_date, end_date, targets):
+    """Generates capacityCount, bookedCount, and availableCount for a date range.
+
+    Args:
+        start_date (str): The start date in YYYY-MM-DD format.
+        end_date (str): The end date in YYYY-MM-DD format.
+
+    Returns:
+        tuple: A tuple containing capacityCount, bookedCount, and availableCount.
+    """
+
+    capacity_count = 0
+    booked_count = 0
+
+    unit_length, genres, program_types = parse_targets(targets)
+
+    # Now you have unit_length and genres extracted
+    print("Querying Inventory for the following parameters:")
+    print("Start Date:", start_date)
+    print("End Date:", end_date)
+    print("Unit Length:", unit_length)
+    print("Genres:", genres)
+    print("Program Types:", program_types)
+
+    capacity_count = get_capacity(start_date, end_date, unit_length, genres, program_types)
+    print("Capacity Cache:", capacity_cache.stats())
 
     # Calculate bookedCount and availableCount
     booked_count = random.randint(int(capacity_count * 0.2), capacity_count) 
@@ -112,52 +228,177 @@ def get_inventory_data(start_date, end_date, targets):
 
     return capacity_count, booked_count, available_count
 
-def main(request):
+def get_inventory_breakdown(start_date, end_date, targets, query_type):
+    """Generates the inventory summary for every day or week of a date range in one pass.
 
-    if request.is_json:
-        # Get the JSON data
-        request_json = request.get_json()
+    Args:
+        start_date (str): The start date in YYYY-MM-DD format.
+        end_date (str): The end date in YYYY-MM-DD format.
+        targets (list): The targets array of the inventory request.
+        query_type (str): "DAILY" or "WEEKLY"; weeks start on start_date.
 
-        # Generate a timestamp for the filename
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    Returns:
+        list: inventorySummary entries with date, capacityCount, bookedCount and availableCount.
+    """
+    unit_length, genres, program_types = parse_targets(targets)
+    print(f"Querying {query_type} Inventory from {start_date} to {end_date} for Unit Length {unit_length}, Genres {genres}, Program Types {program_types}")
 
-        # Create a filename with the timestamp
-        filename = f"request_{timestamp}.json"
+    capacities = get_capacity_breakdown(start_date, end_date, unit_length, genres, program_types, query_type)
+    print("Capacity Cache:", capacity_cache.stats())
 
-        # Extract startDate and endDate
-        start_date_str = request_json.get("startDate")
-        end_date_str = request_json.get("endDate")
-        start_date = start_date_str[:10]  # Extract the first 10 characters for the date
-        end_date = end_date_str[:10]  # Extract the first 10 characters for the date
-       
-        # Access the targets array
-        targets = request_json.get("targets", [])
+    inventory_summary = []
+    for date, capacity_count in capacities:
+        booked_count = random.randint(int(capacity_count * 0.2), capacity_count)
+        inventory_summary.append({
+            "date": date,
+            "capacityCount": capacity_count,
+            "bookedCount": booked_count,
+            "availableCount": capacity_count - booked_count,
+        })
+    return inventory_summary
 
-        # Generate numbers
-        (
-            capacity_count,
-            booked_count,
-            available_count,
-        ) = get_inventory_data(start_date, end_date, targets)
+def build_inventory_response(request_json):
+    """Builds the inventory response for one inventory request.
+
+    Args:
+        request_json (dict): The inventory request from AOS or Operative.One.
 
-        # Replace values in response JSON
+    Returns:
+        dict: The inventory response.
+    """
+    # Extract startDate and endDate
+    start_date_str = request_json.get("startDate")
+    end_date_str = request_json.get("endDate")
+    start_date = start_date_str[:10]  # Extract the first 10 characters for the date
+    end_date = end_date_str[:10]  # Extract the first 10 characters for the date
+
+    # Access the targets array
+    targets = request_json.get("targets", [])
+
+    # Break the range down per day or week when asked to
+    query_type = (request_json.get("queryType") or "SUMMARY").upper()
+    if query_type in BUCKET_DAYS:
         response_json = {
             "inventoryRequestId": request_json.get(
                 "inventoryRequestId"
             ),
-            "queryType": "SUMMARY",
-            "inventorySummary": [
-                {
-                    "date": None,
-                    "capacityCount": capacity_count,
-                    "bookedCount": booked_count,
-                    "availableCount": available_count,
-                }
-            ],
+            "queryType": query_type,
+            "inventorySummary": get_inventory_breakdown(start_date, end_date, targets, query_type),
             "contenders": None,
         }
-
         return response_json
+
+    # Generate numbers
+    (
+        capacity_count,
+        booked_count,
+        available_count,
+    ) = get_inventory_data(start_date, end_date, targets)
+
+    # Replace values in response JSON
+    response_json = {
+        "inventoryRequestId": request_json.get(
+            "inventoryRequestId"
+        ),
+        "queryType": "SUMMARY",
+        "inventorySummary": [
+            {
+                "date": None,
+                "capacityCount": capacity_count,
+                "bookedCount": booked_count,
+                "availableCount": available_count,
+            }
+        ],
+        "contenders": None,
+    }
+
+    return response_json
+
+def main(request):
+
+    if request.is_json:
+        # Get the JSON data
+        request_json = request.get_json()
+
+        return build_inventory_response(request_json)
     else:
         # Handle non-JSON requests (optional)
-        return "Request is not a JSON object"
\ No newline at end of file
+        return "Request is not a JSON object"
+
+def _warm_capacity(request_json):
+    """Computes the capacity of one inventory request into the capacity cache."""
+    start_date = request_json.get("startDate")[:10]
+    end_date = request_json.get("endDate")[:10]
+    unit_length, genres, program_types = parse_targets(request_json.get("targets", []))
+    query_type = (request_json.get("queryType") or "SUMMARY").upper()
+    if query_type in BUCKET_DAYS:
+        get_capacity_breakdown(start_date, end_date, unit_length, genres, program_types, query_type)
+    else:
+        get_capacity(start_date, end_date, unit_length, genres, program_types)
+
+def batch_main(request):
+    """Evaluates many inventory requests, e.g. every line of a proposal, in one invocation.
+
+    Requests with the same dates and targeting are computed once; the distinct
+    ones are computed concurrently before the individual responses are built.
+
+    Args:
+        request (flask.Request): JSON array of inventory requests, or an object with an "inventoryRequests" array.
+
+    Returns:
+        dict: The inventory responses, in request order, under "inventoryResponses".
+    """
+    if not request.is_json:
+        return "Request is not a JSON object"
+
+    request_json = request.get_json()
+    if isinstance(request_json, dict):
+        inventory_requests = request_json.get("inventoryRequests", [])
+    else:
+        inventory_requests = request_json
+    if not isinstance(inventory_requests, list):
+        return "Request is not a list of inventory requests"
+
+    # Deduplicate shared targeting
+    distinct = {}
+    for inventory_request in inventory_requests:
+        if not isinstance(inventory_request, dict):
+            continue  # Reported with its own response below
+        try:
+            unit_length, genres, program_types = parse_targets(inventory_request.get("targets", []))
+            key = targeting_key(
+                inventory_request.get("startDate")[:10],
+                inventory_request.get("endDate")[:10],
+                unit_length,
+                genres,
+                program_types
+            ) + ((inventory_request.get("queryType") or "SUMMARY").upper(),)
+            distinct.setdefault(key, inventory_request)
+        except Exception:
+            pass  # Reported with its own response below
+    print(f"Evaluating {len(distinct)} distinct targetings for {len(inventory_requests)} inventory requests")
+
+    with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+        for future in [executor.submit(_warm_capacity, r) for r in distinct.values()]:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error computing inventory capacity: {str(e)}")
+
+    inventory_responses = []
+    for inventory_request in inventory_requests:
+        if not isinstance(inventory_request, dict):
+            inventory_responses.append({
+                "inventoryRequestId": None,
+                "error": "Inventory request is not a JSON object"
+            })
+            continue
+        try:
+            inventory_responses.append(build_inventory_response(inventory_request))
+        except Exception as e:
+            inventory_responses.append({
+                "inventoryRequestId": inventory_request.get("inventoryRequestId"),
+                "error": str(e)
+            })
+
+    return {"inventoryResponses": inventory_responses}
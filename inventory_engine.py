@@ -0,0 +1,144 @@
+import clients
+import numpy as np
+import os
+import threading
+import time
+
+# Seconds before a snapshot is refreshed in the background
+SNAPSHOT_TTL = int(os.getenv("INVENTORY_SNAPSHOT_TTL", "900"))
+
+_lock = threading.Lock()
+_snapshot = None
+_refreshing = False
+
+
+def round_half_away(values):
+    """Rounds like BigQuery's CAST(... AS INT64): halves away from zero."""
+    return np.sign(values) * np.floor(np.abs(values) + 0.5)
+
+
+class InventorySnapshot:
+    """In-memory columnar copy of the break schedule and its viewing portions.
+
+    Every break of the block schedule becomes one position in a set of NumPy
+    arrays, so a forecast is a few vectorized masks instead of a BigQuery job.
+    Daily viewer totals live in viewership_index.
+
+    Args:
+        breaks (list): Rows with air_length, genre, program_type and portion.
+    """
+
+    def __init__(self, breaks):
+        self.loaded_at = time.monotonic()
+
+        # Break columns
+        self.air_length = np.array(
+            [np.nan if row["air_length"] is None else float(row["air_length"]) for row in breaks],
+            dtype=np.float64
+        )
+        self.portion = np.array(
+            [np.nan if row["portion"] is None else float(row["portion"]) for row in breaks],
+            dtype=np.float64
+        )
+
+        # Genre membership matrix, matching SPLIT(content_library.genre, ',')
+        split_genres = [row["genre"].split(",") if row["genre"] is not None else [] for row in breaks]
+        self.genre_index = {}
+        for genres in split_genres:
+            for genre in genres:
+                self.genre_index.setdefault(genre, len(self.genre_index))
+        self.genre_matrix = np.zeros((len(breaks), len(self.genre_index)), dtype=bool)
+        for i, genres in enumerate(split_genres):
+            for genre in genres:
+                self.genre_matrix[i, self.genre_index[genre]] = True
+
+        # Program type codes
+        self.program_type_index = {}
+        for row in breaks:
+            self.program_type_index.setdefault(row["program_type"], len(self.program_type_index))
+        self.program_type_codes = np.array(
+            [self.program_type_index[row["program_type"]] for row in breaks],
+            dtype=np.int32
+        )
+
+    def view_factor_sum(self, unit_length, genres, program_types):
+        """Returns sum(view_factor) over the breaks matching the targeting.
+
+        Args:
+            unit_length (int): Unit length in seconds
+            genres (list): Genre target values, any of which must match
+            program_types (list): Program type target values
+
+        Returns:
+            float: The summed view factor.
+        """
+        mask = np.ones(len(self.air_length), dtype=bool)
+        if genres:
+            columns = [self.genre_index[genre] for genre in genres if genre in self.genre_index]
+            mask &= self.genre_matrix[:, columns].any(axis=1)
+        if program_types:
+            codes = [self.program_type_index[pt] for pt in program_types if pt in self.program_type_index]
+            mask &= np.isin(self.program_type_codes, codes)
+
+        units = round_half_away(self.air_length[mask] / unit_length)
+        return float(np.nansum(self.portion[mask] * units))
+
+
+def load_snapshot():
+    """Reads the break schedule from BigQuery into a new snapshot.
+
+    Returns:
+        InventorySnapshot: The loaded snapshot.
+    """
+    bigquery_client = clients.get_bigquery_client()
+
+    breaks_query = """
+    SELECT
+        block_schedule.air_length,
+        content_library.genre,
+        content_library.program_type,
+        time_viewership_distribution.portion_of_daily_viewers_watching AS portion
+    FROM
+        `aos-demo-toolkit.inventory.block_schedule` AS block_schedule
+        INNER JOIN `aos-demo-toolkit.inventory.content_library` AS content_library ON block_schedule.content_id = content_library.content_id
+        LEFT JOIN `aos-demo-toolkit.inventory.time_viewership_distribution` AS time_viewership_distribution
+        ON time_viewership_distribution.hour = CAST(block_schedule.air_hour AS BIGNUMERIC)
+    WHERE block_schedule.block_type = 'Break'
+    """
+    snapshot = InventorySnapshot(list(bigquery_client.query(breaks_query).result()))
+    print(f"Inventory snapshot loaded with {len(snapshot.air_length)} breaks")
+    return snapshot
+
+
+def _refresh_in_background():
+    global _snapshot, _refreshing
+    try:
+        _snapshot = load_snapshot()
+    except Exception as e:
+        print(f"Error refreshing inventory snapshot: {str(e)}")
+    finally:
+        _refreshing = False
+
+
+def get_snapshot():
+    """Returns the current snapshot, loading it on first use.
+
+    A stale snapshot keeps serving while a fresh one loads in the background.
+
+    Returns:
+        InventorySnapshot: The current snapshot.
+    """
+    global _snapshot, _refreshing
+    snapshot = _snapshot
+    if snapshot is None:
+        with _lock:
+            if _snapshot is None:
+                _snapshot = load_snapshot()
+            return _snapshot
+
+    if time.monotonic() - snapshot.loaded_at > SNAPSHOT_TTL:
+        with _lock:
+            if not _refreshing:
+                _refreshing = True
+                threading.Thread(target=_refresh_in_background, daemon=True).start()
+    return snapshot
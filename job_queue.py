@@ -0,0 +1,319 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Local SQLite file standing in for a managed queue (Cloud Tasks, Pub/Sub)
+QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "/tmp/job_queue.sqlite3")
+QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "sqlite")
+WORKERS = int(os.getenv("JOB_QUEUE_WORKERS", "2"))
+MAX_PENDING = int(os.getenv("JOB_QUEUE_MAX_PENDING", "1000"))
+MAX_ATTEMPTS = int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", "5"))
+# Only the most recent failed jobs are kept, for inspection
+MAX_FAILED = int(os.getenv("JOB_QUEUE_MAX_FAILED", "100"))
+POLL_INTERVAL = 1.0
+
+# A job still not ready this many seconds after it was queued fails; until then
+# its NotReady delays double, up to NOT_READY_MAX_DELAY
+NOT_READY_TIMEOUT = float(os.getenv("JOB_QUEUE_NOT_READY_TIMEOUT", "7200"))
+NOT_READY_MAX_DELAY = float(os.getenv("JOB_QUEUE_NOT_READY_MAX_DELAY", "600"))
+
+# Payload key listing the fields that are kept in memory instead of in the queue file
+SECRET_FIELDS = "secret_fields"
+
+
+class QueueFull(Exception):
+    """Raised when a new job would exceed JOB_QUEUE_MAX_PENDING."""
+
+
+class NotReady(Exception):
+    """Raised by a handler whose inputs are not available yet.
+
+    The job is retried after `delay` seconds, doubling on every further
+    NotReady, and fails once it is NOT_READY_TIMEOUT seconds old. These
+    retries do not count towards MAX_ATTEMPTS.
+    """
+
+    def __init__(self, message, delay=2.0):
+        super().__init__(message)
+        self.delay = delay
+
+
+class SQLiteQueue:
+    """Durable job queue in a local SQLite file.
+
+    At most one pending job exists per (kind, key): putting a job whose key is
+    already pending replaces that job's payload instead of adding a second run.
+    A job is never claimed while another job with the same key is running.
+    Payloads of failed jobs are cleared; only the error of the last
+    MAX_FAILED failed jobs is kept.
+
+    Other backends only need the same put/claim/complete/retry/fail methods.
+
+    Args:
+        path (str): Path of the SQLite database file.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.executescript("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            not_ready INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL,
+            created_at REAL,
+            error TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS jobs_pending_key ON jobs (kind, key) WHERE status = 'pending';
+        """)
+        # Queue files written before created_at and not_ready existed
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if "created_at" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN created_at REAL")
+        if "not_ready" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN not_ready INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("UPDATE jobs SET created_at = run_after WHERE created_at IS NULL")
+        self._conn.execute("UPDATE jobs SET payload = '{}' WHERE status = 'failed'")
+        self._prune_failed()
+        # Jobs that were running when the process died are run again
+        self._conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+
+    def put(self, kind, key, payload, delay=0):
+        """Adds a job, or coalesces it into the pending job with the same kind and key.
+
+        Returns:
+            tuple: (id of the pending job, True if the job was coalesced into an existing one)
+        """
+        with self._lock:
+            coalesced = self._conn.execute(
+                "SELECT 1 FROM jobs WHERE kind = ? AND key = ? AND status = 'pending'",
+                (kind, key)
+            ).fetchone() is not None
+            if not coalesced:
+                pending = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+                if pending >= MAX_PENDING:
+                    raise QueueFull(f"Job queue has {pending} pending jobs")
+            self._conn.execute(
+                """
+                INSERT INTO jobs (kind, key, payload, run_after, created_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (kind, key) WHERE status = 'pending'
+                DO UPDATE SET payload = excluded.payload, run_after = excluded.run_after,
+                    created_at = excluded.created_at, attempts = 0, not_ready = 0
+                """,
+                (kind, key, json.dumps(payload), time.time() + delay, time.time())
+            )
+            job_id = self._conn.execute(
+                "SELECT id FROM jobs WHERE kind = ? AND key = ? AND status = 'pending'",
+                (kind, key)
+            ).fetchone()[0]
+            return job_id, coalesced
+
+    def claim(self):
+        """Marks the oldest runnable job as running and returns it.
+
+        Returns:
+            tuple: (id, kind, key, payload, attempts, not_ready, created_at), or None if
+                nothing is runnable. attempts includes this run; not_ready counts the
+                earlier runs that ended in NotReady, which are not attempts.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT id, kind, key, payload, attempts, not_ready, created_at FROM jobs AS job
+                WHERE status = 'pending' AND run_after <= ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM jobs AS running
+                    WHERE running.kind = job.kind AND running.key = job.key AND running.status = 'running'
+                )
+                ORDER BY run_after, id
+                LIMIT 1
+                """,
+                (time.time(),)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1 WHERE id = ?", (row[0],))
+            return row[0], row[1], row[2], json.loads(row[3]), row[4] + 1, row[5], row[6]
+
+    def complete(self, job_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def retry(self, job_id, delay, error, not_ready=False):
+        """Puts a job back to pending, unless a newer push of the same key is already pending.
+
+        Args:
+            not_ready (bool): The run ended in NotReady; it is counted in
+                not_ready instead of attempts.
+
+        Returns:
+            bool: False if the job was dropped in favour of the newer push.
+        """
+        with self._lock:
+            try:
+                self._conn.execute(
+                    """
+                    UPDATE jobs SET status = 'pending', run_after = ?, error = ?,
+                        attempts = attempts - ?, not_ready = not_ready + ?
+                    WHERE id = ?
+                    """,
+                    (time.time() + delay, error, int(not_ready), int(not_ready), job_id)
+                )
+                return True
+            except sqlite3.IntegrityError:
+                # The newer pending job supersedes this one
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                return False
+
+    def fail(self, job_id, error):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', payload = '{}', error = ? WHERE id = ?",
+                (error, job_id)
+            )
+            self._prune_failed()
+
+    def _prune_failed(self):
+        self._conn.execute(
+            """
+            DELETE FROM jobs WHERE status = 'failed' AND id NOT IN (
+                SELECT id FROM jobs WHERE status = 'failed' ORDER BY id DESC LIMIT ?
+            )
+            """,
+            (MAX_FAILED,)
+        )
+
+
+BACKENDS = {
+    "sqlite": lambda: SQLiteQueue(QUEUE_PATH),
+}
+
+_handlers = {}
+_secrets = {}  # job id -> payload fields that must not be written to the queue file
+_secrets_lock = threading.Lock()
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_queue = None
+_workers = []
+
+
+def register(kind, handler):
+    """Registers the function that runs jobs of a kind; it is called with the job payload."""
+    _handlers[kind] = handler
+
+
+def _get_queue():
+    global _queue
+    with _lock:
+        if _queue is None:
+            _queue = BACKENDS[QUEUE_BACKEND]()
+        return _queue
+
+
+def _finish(queue, job_id, error=None):
+    """Completes or fails a job and forgets its secrets."""
+    with _secrets_lock:
+        _secrets.pop(job_id, None)
+    if error is None:
+        queue.complete(job_id)
+    else:
+        queue.fail(job_id, error)
+
+
+def _retry(queue, job_id, delay, error, not_ready=False):
+    if not queue.retry(job_id, delay, error, not_ready):
+        with _secrets_lock:
+            _secrets.pop(job_id, None)
+
+
+def _run_job(queue, job):
+    job_id, kind, key, payload, attempts, not_ready, created_at = job
+    payload = dict(payload)
+    secret_fields = payload.pop(SECRET_FIELDS, None)
+    if secret_fields:
+        with _secrets_lock:
+            secrets = _secrets.get(job_id)
+        if secrets is None:
+            print(f"Job {kind}:{key} failed: its credentials were lost with the instance that queued it")
+            _finish(queue, job_id, "Credentials not available after restart")
+            return
+        payload.update(secrets)
+
+    try:
+        _handlers[kind](payload)
+        _finish(queue, job_id)
+        print(f"Job {kind}:{key} completed")
+    except NotReady as e:
+        delay = min(e.delay * 2 ** not_ready, NOT_READY_MAX_DELAY)
+        if time.time() + delay - created_at > NOT_READY_TIMEOUT:
+            print(f"Job {kind}:{key} still not ready after {not_ready + 1} runs, giving up: {str(e)}")
+            _finish(queue, job_id, f"Not ready: {str(e)}")
+        else:
+            print(f"Job {kind}:{key} not ready, retrying in {delay}s: {str(e)}")
+            _retry(queue, job_id, delay, str(e), not_ready=True)
+    except Exception as e:
+        if attempts < MAX_ATTEMPTS:
+            print(f"Job {kind}:{key} failed on attempt {attempts}, retrying: {str(e)}")
+            _retry(queue, job_id, 2 ** attempts, str(e))
+        else:
+            print(f"Job {kind}:{key} failed after {attempts} attempts: {str(e)}")
+            _finish(queue, job_id, str(e))
+
+
+def _worker():
+    queue = _get_queue()
+    while True:
+        job = queue.claim()
+        if job is None:
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+        _run_job(queue, job)
+
+
+def start():
+    """Starts the worker threads once per process; pending jobs left by a previous run are picked up."""
+    with _lock:
+        if _workers:
+            return
+        for _ in range(WORKERS):
+            thread = threading.Thread(target=_worker, daemon=True)
+            thread.start()
+            _workers.append(thread)
+
+
+def enqueue(kind, key, payload, delay=0, secrets=None):
+    """Queues a job for the worker pool.
+
+    Args:
+        kind (str): Registered job kind, e.g. "delivery"
+        key (str): Deduplication key; pushes with the same key coalesce while pending
+        payload (dict): JSON-serializable arguments for the handler
+        delay (float): Seconds before the job may run
+        secrets (dict): Further handler arguments, such as credentials, that
+            are only kept in this process's memory and never written to the
+            queue file. A job whose secrets were lost in a restart fails.
+
+    Returns:
+        bool: True if the job was coalesced into an already pending one.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"No handler registered for job kind: {kind}")
+    if secrets:
+        payload = dict(payload, **{SECRET_FIELDS: sorted(secrets)})
+    queue = _get_queue()
+    # Held until the secrets are stored, so a worker cannot claim the job without them
+    with _secrets_lock:
+        job_id, coalesced = queue.put(kind, str(key), payload, delay)
+        if secrets:
+            _secrets[job_id] = dict(secrets)
+    start()
+    _wakeup.set()
+    return coalesced
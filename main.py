@@ -1,13 +1,79 @@
 import functions_framework
 from flask import Response
-from google.cloud import storage
+import archive
 import json
 import datetime
+import importlib
+import os
+import threading
 import uuid
 
+
+class LazyHandler:
+    """An endpoint handler whose module is imported on first call, then kept.
+
+    Endpoints only pay for the SDKs they actually use, e.g. /creds never loads
+    BigQuery, NumPy or WeasyPrint.
+    """
+
+    def __init__(self, target):
+        self.module_name, self.function_name = target.rsplit(".", 1)
+        self._function = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if self._function is None:
+            with self._lock:
+                if self._function is None:
+                    module = importlib.import_module(self.module_name)
+                    self._function = getattr(module, self.function_name)
+        return self._function
+
+    def __call__(self, request):
+        return self.resolve()(request)
+
+
+# Handlers by the last segment of the request path
+HANDLERS = {
+    "inventory": LazyHandler("inventory.main"),  # Module name and function name
+    "inventory_batch": LazyHandler("inventory.batch_main"),  # Many inventory requests at once
+    "advertisers": LazyHandler("advertisers.main"),
+    "orders": LazyHandler("orders.main"),
+    "work_order": LazyHandler("work_order.main"),  # Add the work_order module
+    "work_order_batch": LazyHandler("work_order.batch_main"),  # Many work orders at once, JSON list or NDJSON
+    "creds": LazyHandler("creds.main")  # Add the new creds module
+}
+
+# Comma separated endpoints to import at instance start instead of on first request,
+# e.g. "inventory,orders" when min instances keep them warm anyway
+for _name in filter(None, (name.strip() for name in os.getenv("PRELOAD_HANDLERS", "").split(","))):
+    if _name in HANDLERS:
+        HANDLERS[_name].resolve()
+    else:
+        print(f"Ignoring unknown endpoint {_name} in PRELOAD_HANDLERS")
+
+def is_error_response(response):
+    """Whether a handler reported a failure in its response body."""
+    return isinstance(response, dict) and ("error" in response or response.get("status") in ("error", "partial"))
+
+def archive_response(request_data, request_archived, status, response):
+    """Queues a response for the archive, along with its request if that was not archived yet."""
+    if not request_archived:
+        archive.enqueue("requests", request_data)
+    archive.enqueue("responses", {
+        "id": request_data["id"],
+        "timestamp": request_data["timestamp"],
+        "path": request_data["path"],
+        "status": status,
+        "response": response
+    })
+
 @functions_framework.http
 def hello_http(request):
-    """Main Cloud Function that saves the request to a file and dispatches requests based on the URL path.
+    """Main Cloud Function that archives the request and dispatches requests based on the URL path.
+
+    Only a sample of successful calls is archived, at the rate configured for
+    the endpoint; failed calls are always archived with their request.
 
     Args:
         request (flask.Request): The request object.
@@ -16,83 +82,58 @@ def hello_http(request):
         str: The response from the called function.
     """
 
-    # Get a reference to the GCS bucket and folder
-    bucket_name = "aos-demo-toolkit"  # Replace with your bucket name
-    folder_name = "requests"
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
+    # Get the function name from the request URL
+    function_name = request.path.split("/")[-1]
+    sampled = archive.is_sampled(function_name)
+    request_data = None
 
-    # Extract data from the request and save in readable format
+    # Extract data from the request and queue it for the archive
     try:
-        # Get the JSON data
-        request_json = request.get_json()
+        # Get the JSON data; None for bodies that are not JSON, e.g. NDJSON batches
+        request_json = request.get_json(silent=True)
 
-        # Generate a timestamp for the filename
+        # Timestamp and id shared by the archived request and response
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         short_uuid = str(uuid.uuid4())[:8]
 
-        # Create a filename with the timestamp
-        filename = f"request_{timestamp}_{short_uuid}.json"
-
-        # Construct the full path within the bucket
-        blob = bucket.blob(f"{folder_name}/{filename}")
-
         # Create a dictionary to hold the entire request data
         request_data = {
+            "id": short_uuid,
+            "timestamp": timestamp,
             "path": request.path,
+            "sample_rate": archive.sample_rate(function_name),
             "headers": dict(request.headers),
             "json": request_json
         }
+        if request_json is None:
+            request_data["body"] = request.get_data(as_text=True)
 
-        # Save the request data to the GCS bucket
-        blob.upload_from_string(
-            data=json.dumps(request_data),
-            content_type='application/json'
-        )
-
-        # Get the function name from the request URL
-        function_name = request.path.split("/")[-1]
-
-        # Define a dictionary mapping function names to modules
-        functions = {
-            "inventory": "inventory.main",  # Module name and function name
-            "advertisers": "advertisers.main",
-            "orders": "orders.main",
-            "work_order": "work_order.main",  # Add the work_order module
-            "creds": "creds.main"  # Add the new creds module
-        }
+        # Buffered and written to GCS in batches by the archive flusher
+        if sampled:
+            archive.enqueue("requests", request_data)
 
-        # Import the corresponding module dynamically
-        if function_name in functions:
-            module_name, function_name = functions[function_name].rsplit(".", 1)
-            imported_module = __import__(module_name)
-            function = getattr(imported_module, function_name)
+        # Look up the handler; its module is imported on the first request only
+        if function_name in HANDLERS:
             # Call the function with the request
-            response = function(request)
-
-            folder_name = "responses"
-
-            # Store the response in a file
-            try:
-                # Create a filename with the timestamp
-                filename = f"response_{timestamp}_{short_uuid}.json"
-
-                # Construct the full path within the bucket
-                blob = bucket.blob(f"{folder_name}/{filename}")
+            response = HANDLERS[function_name](request)
 
-                # Upload the entire request data in a readable format
-                blob.upload_from_string(json.dumps(response, indent=2))
-            except Exception as e:
-                error_response = Response(json.dumps({"error": str(e)}), status=500, mimetype='application/json')
-                return error_response
+            # Serialize before archiving so an unserializable response fails here, as before
+            response_body = json.dumps(response)
+            if sampled or is_error_response(response):
+                archive_response(request_data, sampled, 200, response)
 
             # Return the response as JSON
-            json_response = Response(json.dumps(response), status=200, mimetype='application/json')
+            json_response = Response(response_body, status=200, mimetype='application/json')
             return json_response
         else:
-            error_response = Response(json.dumps({"error": "Function not found"}), status=404, mimetype='application/json')
+            error = {"error": "Function not found"}
+            archive_response(request_data, sampled, 404, error)
+            error_response = Response(json.dumps(error), status=404, mimetype='application/json')
             return error_response
 
     except Exception as e:
-        error_response = Response(json.dumps({"error": str(e)}), status=500, mimetype='application/json')
+        error = {"error": str(e)}
+        if request_data is not None:
+            archive_response(request_data, sampled, 500, error)
+        error_response = Response(json.dumps(error), status=500, mimetype='application/json')
         return error_response
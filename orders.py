@@ -1,17 +1,30 @@
-from google.cloud import bigquery
+import clients
 from datetime import datetime
 import delivery
+import id_allocator
+import job_queue
 import work_order
-import threading
-import time
 import os
 
-def delayed_generate_delivery_data(order_id, basic_auth):
-    time.sleep(5)  # Wait for 5 seconds
-    delivery.generate_delivery_data(order_id, basic_auth)
+# Set WORK_ORDER_IN_BACKGROUND=1 to generate work orders after responding to AOS
+WORK_ORDER_IN_BACKGROUND = os.getenv("WORK_ORDER_IN_BACKGROUND") == "1"
+
+def run_delivery_job(payload):
+    """Generates delivery data for an order once all of its line items are visible.
+
+    Args:
+        payload (dict): order_id, line_item_count and basic_auth of the latest push of the order
+    """
+    order_id = payload["order_id"]
+    visible = delivery.count_line_items(order_id)
+    if visible < payload["line_item_count"]:
+        raise job_queue.NotReady(f"{visible} of {payload['line_item_count']} line items visible for order {order_id}")
+    delivery.generate_delivery_data(order_id, payload["basic_auth"])
+
+job_queue.register("delivery", run_delivery_job)
 
 def upsert_order(name, order_id, oms_id, start_date, end_date, advertiser_id, salesperson_email_id, salesperson_name):
-    bigquery_client = bigquery.Client()
+    bigquery_client = clients.get_bigquery_client()
     table_id = "aos-demo-toolkit.orders.orders"
     
     order_exists = False
@@ -52,17 +65,10 @@ def upsert_order(name, order_id, oms_id, start_date, end_date, advertiser_id, sa
         query_job = bigquery_client.query(query)
         results = query_job.result()
     else:
-        # Find the maximum value in the id column
-        max_id_query = """
-        SELECT MAX(id) as max_id
-        FROM `aos-demo-toolkit.orders.orders`
-        """
-        max_id_job = bigquery_client.query(max_id_query)
-        max_id_result = max_id_job.result()
-        max_id = next(max_id_result)["max_id"] or 0
+        # Allocate a new id for the order
+        new_id = id_allocator.next_id("orders")
 
         # Insert a new row into the table
-        new_id = max_id + 1
         insert_query = f"""
         INSERT INTO `aos-demo-toolkit.orders.orders` (id, name, oms_id, start_date, end_date, advertiser_id, salesperson_email_id, salesperson_name)
         VALUES ({new_id}, '{name}', '{oms_id}', '{start_date_dt}', '{end_date_dt}', CAST('{advertiser_id}' AS INT64), '{salesperson_email_id}', '{salesperson_name}')
@@ -75,103 +81,144 @@ def upsert_order(name, order_id, oms_id, start_date, end_date, advertiser_id, sa
 
     return order_id
 
-def upsert_lineitem(name, lineitem_id, oms_id, start_date, end_date, cost_type, quantity, unit_cost, order_id, advertiser_id):
-    """Checks to see if a lineitem exists and returns that ID.
+def lineitem_struct(bigquery, idx, lineitem, lineitem_id, new_id):
+    """Builds the staged row of one line item for upsert_lineitems.
 
     Args:
-        name of the lineitem from the OMS
-        lineitem_id of the lineitem from adsrv
-        sourceLineitemId of the lineitem from the OMS
-        start_date of the lineitem
-        end_date of the lineitem
-        cost_method of the lineitem
-        quantity of the lineitem
-        unit_cost of the lineitem
+        idx (int): Position of the line item in the payload
+        lineitem (dict): Line item from the OMS order payload
+        lineitem_id (int): Existing id to update, or 0
+        new_id (int): Id to insert the line item under, or None if it should already exist
+    """
+    return bigquery.StructQueryParameter(
+        None,
+        bigquery.ScalarQueryParameter("idx", "INT64", idx),
+        bigquery.ScalarQueryParameter("lineitem_id", "INT64", lineitem_id),
+        bigquery.ScalarQueryParameter("new_id", "INT64", new_id),
+        bigquery.ScalarQueryParameter("name", "STRING", lineitem.get("name")),
+        bigquery.ScalarQueryParameter("oms_id", "STRING", lineitem.get("sourceLineitemId")),
+        bigquery.ScalarQueryParameter("start_date", "DATETIME", datetime.strptime(lineitem.get("startDate"), "%Y-%m-%d %H:%M")),
+        bigquery.ScalarQueryParameter("end_date", "DATETIME", datetime.strptime(lineitem.get("endDate"), "%Y-%m-%d %H:%M")),
+        bigquery.ScalarQueryParameter("cost_method", "STRING", lineitem.get("costType")),
+        bigquery.ScalarQueryParameter("quantity", "INT64", int(lineitem.get("quantity"))),
+        bigquery.ScalarQueryParameter("unit_cost", "FLOAT64", float(lineitem.get("unitCost"))),
+    )
+
+def merge_lineitems(staged_rows, order_id, advertiser_id):
+    """Stages line items, resolves their ids and applies them with one MERGE.
 
     Returns:
-        lineitemId: The ID of the lineitem in the OMS system. 0 if not found.
+        dict: Assigned id by payload position; None for a line item whose
+            given id does not exist and that had no new id to insert under.
     """
-    
-    # Get a reference to the BigQuery client and dataset
-    bigquery_client = bigquery.Client()
-    
-    # Modify dates
-    start_date_dt = datetime.strptime(start_date, "%Y-%m-%d %H:%M").strftime("%Y-%m-%d %H:%M:%S")
-    end_date_dt = datetime.strptime(end_date, "%Y-%m-%d %H:%M").strftime("%Y-%m-%d %H:%M:%S")
-    
-    lineitem_exists = False
+    bigquery = clients.bigquery_module()
+    bigquery_client = clients.get_bigquery_client()
+    table_id = "aos-demo-toolkit.orders.line_items"
 
-    if lineitem_id > 0:
-        # Check if the lineitem_id exists
-        query = f"""
-        SELECT *
-        FROM `aos-demo-toolkit.orders.line_items`
-        WHERE id = {lineitem_id}
-        LIMIT 1
-        """
+    # Stage, merge and read back the assigned ids in one multi-statement job
+    query = f"""
+    CREATE TEMP TABLE staged_line_items AS
+    SELECT
+        COALESCE(existing.id, src.new_id) AS id,
+        src.idx,
+        src.name,
+        src.oms_id,
+        src.start_date,
+        src.end_date,
+        src.cost_method,
+        src.quantity,
+        src.unit_cost
+    FROM UNNEST(@lineitems) AS src
+    LEFT JOIN `{table_id}` AS existing
+    ON src.lineitem_id > 0 AND existing.id = src.lineitem_id;
 
-        # Run the query
-        query_job = bigquery_client.query(query)
-        results = query_job.result()
-        for row in results:
-            lineitem_exists = True
+    -- A payload may repeat a line item id; like sequential updates, the last one wins
+    MERGE `{table_id}` AS target
+    USING (
+        SELECT * FROM staged_line_items
+        WHERE id IS NOT NULL
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY id ORDER BY idx DESC) = 1
+    ) AS source
+    ON target.id = source.id
+    WHEN MATCHED THEN
+        UPDATE SET name = source.name,
+            oms_id = source.oms_id,
+            start_date = source.start_date,
+            end_date = source.end_date,
+            cost_method = source.cost_method,
+            quantity = source.quantity,
+            unit_cost = source.unit_cost,
+            order_id = @order_id,
+            advertiser_id = @advertiser_id
+    WHEN NOT MATCHED THEN
+        INSERT (id, name, oms_id, start_date, end_date, cost_method, quantity, unit_cost, order_id, advertiser_id)
+        VALUES (source.id, source.name, source.oms_id, source.start_date, source.end_date, source.cost_method, source.quantity, source.unit_cost, @order_id, @advertiser_id);
 
-    if lineitem_exists:
-        # Update the existing row
-        table_id = "aos-demo-toolkit.orders.line_items"
-        query = f"""
-            UPDATE `{table_id}`
-            SET name = '{name}',
-                oms_id = '{oms_id}',
-                start_date = '{start_date_dt}',
-                end_date = '{end_date_dt}',
-                cost_method = '{cost_type}',
-                quantity = CAST('{quantity}' AS INT64),
-                unit_cost = CAST('{unit_cost}' AS FLOAT64),
-                order_id = {order_id},
-                advertiser_id = {advertiser_id}
-            WHERE id = {lineitem_id}
-        """
-        # Run the query
-        query_job = bigquery_client.query(query)
-        results = query_job.result()
-        lineitem = {
-            "lineitemId": str(lineitem_id),
-            "sourceLineitemId": oms_id,
-            "name": name,
-            "status": "success",
-            "errorMessage": None
-        }
-    else:
-        # Lineitem not found
-        # Find the maximum value in the id column
-        max_id_query = """
-        SELECT MAX(id) as max_id
-        FROM `aos-demo-toolkit.orders.line_items`
-        """
-        max_id_job = bigquery_client.query(max_id_query)
-        max_id_result = max_id_job.result()
-        max_id = next(max_id_result)["max_id"] or 0
+    SELECT idx, id FROM staged_line_items ORDER BY idx;
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("lineitems", "STRUCT", staged_rows),
+            bigquery.ScalarQueryParameter("order_id", "INT64", int(order_id)),
+            bigquery.ScalarQueryParameter("advertiser_id", "INT64", int(advertiser_id)),
+        ]
+    )
 
-        # Insert a new row into the table
-        new_id = max_id + 1
-        insert_query = f"""
-        INSERT INTO `aos-demo-toolkit.orders.line_items` (id, name, oms_id, start_date, end_date, cost_method, quantity, unit_cost, order_id, advertiser_id)
-        VALUES ({new_id}, '{name}', '{oms_id}', '{start_date_dt}', '{end_date_dt}', '{cost_type}', CAST('{quantity}' AS INT64), CAST('{unit_cost}' AS FLOAT64), {order_id}, {advertiser_id})
-        """
-        insert_job = bigquery_client.query(insert_query)
-        insert_job.result()  # Wait for the insert to complete
+    # Run the script; the result is the final SELECT
+    query_job = bigquery_client.query(query, job_config=job_config)
+    return {row["idx"]: row["id"] for row in query_job.result()}
+
+def upsert_lineitems(lineitems, order_id, advertiser_id):
+    """Upserts all line items of an order with a single BigQuery job.
+
+    The line items are passed as an array of structs, staged into a temp table
+    that resolves existing ids, and applied with one MERGE. Ids are only
+    allocated for line items without one; a line item whose given id is not
+    in the table is inserted under a new id in a second, rarely needed job.
 
-        lineitem_id = new_id
-        print(f"New lineitem inserted with id {lineitem_id}")
-        lineitem = {
-            "lineitemId": str(lineitem_id),
-            "sourceLineitemId": oms_id,
-            "name": name,
+    Args:
+        lineitems (list): Line items from the OMS order payload
+        order_id (int): ID of the order the line items belong to
+        advertiser_id (int): ID of the advertiser of the order
+
+    Returns:
+        list: One lineitem response per input line item, in input order.
+    """
+    if not lineitems:
+        return []
+
+    bigquery = clients.bigquery_module()
+    lineitem_ids = [int(lineitem.get("lineitemId") or 0) for lineitem in lineitems]
+
+    # New ids only for line items AOS has not seen an id for yet
+    new_ids = iter(id_allocator.allocate_ids("line_items", lineitem_ids.count(0)))
+    staged_rows = [
+        lineitem_struct(bigquery, idx, lineitem, lineitem_ids[idx], None if lineitem_ids[idx] else next(new_ids))
+        for idx, lineitem in enumerate(lineitems)
+    ]
+    assigned_ids = merge_lineitems(staged_rows, order_id, advertiser_id)
+
+    # Ids that are not in the table, e.g. after it was reset, get new ones
+    missing = [idx for idx in range(len(lineitems)) if assigned_ids[idx] is None]
+    if missing:
+        new_ids = id_allocator.allocate_ids("line_items", len(missing))
+        staged_rows = [
+            lineitem_struct(bigquery, idx, lineitems[idx], 0, new_id)
+            for idx, new_id in zip(missing, new_ids)
+        ]
+        assigned_ids.update(merge_lineitems(staged_rows, order_id, advertiser_id))
+    print(f"Upserted {len(lineitems)} lineitems for order {order_id}")
+
+    return [
+        {
+            "lineitemId": str(assigned_ids[idx]),
+            "sourceLineitemId": lineitem.get("sourceLineitemId"),
+            "name": lineitem.get("name"),
             "status": "success",
             "errorMessage": None
         }
-    return lineitem
+        for idx, lineitem in enumerate(lineitems)
+    ]
 
 def main(request):
     if request.is_json:
@@ -195,36 +242,36 @@ def main(request):
 
         advertiser_id = request_json.get("advertiserId")
 
-        lineitems = []
-        for lineitem in request_json.get("lineitems"):
-            lineitem_id = lineitem.get("lineitemId")
-            
-            if not lineitem_id:
-                lineitem_id = 0
-            
-            lineitems.append(upsert_lineitem(
-                lineitem.get("name"),
-                int(lineitem_id),
-                lineitem.get("sourceLineitemId"),
-                lineitem.get("startDate"),
-                lineitem.get("endDate"),
-                lineitem.get("costType"),
-                int(lineitem.get("quantity")),
-                float(lineitem.get("unitCost")),
-                order_id,
-                advertiser_id
-            ))
-
-        # Start the background thread to generate delivery data
+        lineitems = upsert_lineitems(request_json.get("lineitems"), order_id, advertiser_id)
+
+        # Queue delivery generation; repeated pushes of the order coalesce into one run
         basic_auth = request.headers.get("Authorization")
-        threading.Thread(target=delayed_generate_delivery_data, args=(order_id, basic_auth)).start()
+        if basic_auth:
+            try:
+                # The credentials stay in memory; only the order is written to the queue file
+                coalesced = job_queue.enqueue("delivery", order_id, {
+                    "order_id": order_id,
+                    # Repeated lineitemIds are merged into one line item
+                    "line_item_count": len({lineitem["lineitemId"] for lineitem in lineitems})
+                }, secrets={"basic_auth": basic_auth})
+                print(f"Delivery job for order {order_id} {'coalesced' if coalesced else 'queued'}")
+            except job_queue.QueueFull as e:
+                print(f"Error queueing delivery job: {str(e)}")
+        else:
+            print("No Authorization header, skipping delivery generation")
 
         # Generate work order HTML, save to GCS, and post AOS note
         try:
             basic_auth = request.headers.get("Authorization")
             env_url = os.getenv("AOS_ENV_URL") or "aos-stg-gw.operativeone.com"  # Default to staging if not set
-            work_order_result = work_order.generate_work_order(request_json, basic_auth=basic_auth, env_url=env_url)
-            print(f"Work order generation result: {work_order_result}")
+            if WORK_ORDER_IN_BACKGROUND:
+                # Respond to AOS now; repeated pushes of the order coalesce into one run
+                work_order_job = {"order_data": request_json, "env_url": env_url}
+                job_queue.enqueue("work_order", request_json.get("sourceOrderId"), work_order_job, secrets={"basic_auth": basic_auth})
+                print("Work order generation queued")
+            else:
+                work_order_result = work_order.generate_work_order(request_json, basic_auth=basic_auth, env_url=env_url)
+                print(f"Work order generation result: {work_order_result}")
         except Exception as e:
             print(f"Error generating work order: {str(e)}")
 
@@ -0,0 +1,137 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import os
+import threading
+
+# Worker processes rendering PDFs, and how many renders may be queued or running
+WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+QUEUE_SIZE = int(os.getenv("PDF_QUEUE_SIZE", str(WORKERS * 4)))
+
+# Seconds a submitter waits by default for a queue slot before giving up
+SUBMIT_TIMEOUT = float(os.getenv("PDF_SUBMIT_TIMEOUT", "120"))
+
+_lock = threading.Lock()
+_pool = None
+_callbacks = None
+_slots = threading.BoundedSemaphore(QUEUE_SIZE)
+
+# Per-process WeasyPrint state, set up once by _init_worker
+_html_class = None
+_font_config = None
+
+
+class QueueFull(Exception):
+    """Raised by submit when no render slot frees up in time."""
+
+
+def _init_worker():
+    """Imports WeasyPrint and loads fonts once per worker process."""
+    global _html_class, _font_config
+    from weasyprint import HTML
+    from weasyprint.text.fonts import FontConfiguration
+
+    # Suppress WeasyPrint and fontTools debug/info logs
+    logging.getLogger("weasyprint").setLevel(logging.WARNING)
+    logging.getLogger("fontTools").setLevel(logging.WARNING)
+    logging.getLogger("PIL").setLevel(logging.WARNING)
+    logging.getLogger("cairocffi").setLevel(logging.WARNING)
+    logging.getLogger("py.warnings").setLevel(logging.ERROR)
+
+    _html_class = HTML
+    _font_config = FontConfiguration()
+    # A first render pulls in fontconfig caches and the default stylesheets
+    _html_class(string="<p>warm up</p>").write_pdf(font_config=_font_config)
+
+
+def _render(html_content):
+    return _html_class(string=html_content).write_pdf(font_config=_font_config)
+
+
+def _get_pools(broken_pool=None):
+    """Returns the render and callback pools, replacing the render pool if it is broken_pool."""
+    global _pool, _callbacks
+    with _lock:
+        if _pool is not None and _pool is broken_pool:
+            # A worker died, e.g. killed for memory on a huge order; its pool takes no more work
+            print("PDF render pool is broken, starting a new one")
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _pool is None:
+            # Spawned workers do not inherit the parent's client threads and sockets
+            _pool = ProcessPoolExecutor(
+                max_workers=WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        if _callbacks is None:
+            _callbacks = ThreadPoolExecutor(max_workers=WORKERS)
+        return _pool, _callbacks
+
+
+def submit(html_content, on_done=None, on_error=None, timeout=None):
+    """Queues a PDF render, blocking while QUEUE_SIZE renders are already pending.
+
+    A pool broken by a dead worker is replaced and the render submitted again.
+
+    Args:
+        html_content (str): HTML to render
+        on_done (callable): Called with the PDF bytes once rendered, on a
+            callback thread so slow work like uploads does not hold up the pool.
+        on_error (callable): Called with the exception if the render fails.
+        timeout (float): Seconds to wait for a queue slot, SUBMIT_TIMEOUT by
+            default; 0 fails at once when the queue is full.
+
+    Returns:
+        concurrent.futures.Future: Resolves to the PDF bytes.
+
+    Raises:
+        QueueFull: No render slot freed up within the timeout.
+        BrokenProcessPool: The replacement pool broke as well.
+    """
+    timeout = SUBMIT_TIMEOUT if timeout is None else timeout
+    pool, callbacks = _get_pools()
+    if not _slots.acquire(timeout=timeout):
+        raise QueueFull(f"PDF render queue still full after {timeout:g} seconds")
+    try:
+        try:
+            future = pool.submit(_render, html_content)
+        except BrokenProcessPool:
+            pool, callbacks = _get_pools(broken_pool=pool)
+            future = pool.submit(_render, html_content)
+    except Exception:
+        _slots.release()
+        raise
+
+    def _finished(future):
+        _slots.release()
+        if on_done is None:
+            return
+        try:
+            pdf_bytes = future.result()
+        except Exception as e:
+            print(f"Error rendering PDF: {str(e)}")
+            if on_error is not None:
+                callbacks.submit(_run_callback, on_error, e)
+            return
+        callbacks.submit(_run_callback, on_done, pdf_bytes)
+
+    future.add_done_callback(_finished)
+    return future
+
+
+def _run_callback(callback, arg):
+    try:
+        callback(arg)
+    except Exception as e:
+        print(f"Error in PDF callback: {str(e)}")
+
+
+def render(html_content):
+    """Renders a PDF in the worker pool and waits for it.
+
+    Returns:
+        bytes: The PDF.
+    """
+    return submit(html_content).result()
@@ -0,0 +1,175 @@
+import clients
+import datetime
+import numpy as np
+import os
+import threading
+import time
+
+# Seconds between checks for newly landed forecast dates
+EXTEND_INTERVAL = int(os.getenv("VIEWERSHIP_INDEX_INTERVAL", "300"))
+
+_lock = threading.Lock()
+_index = None
+_extending = False
+
+
+class DailyViewershipIndex:
+    """Cumulative sum of daily_viewership_forecast.viewers over a dense calendar.
+
+    prefix[i] holds the viewers of every date before first_date + i days, so
+    the total of any date range is the difference of two entries.
+    """
+
+    def __init__(self):
+        self.first_date = None
+        self.prefix = np.zeros(1, dtype=np.float64)
+        self.checked_at = 0.0
+
+    @property
+    def last_date(self):
+        """The last date covered by the index, or None when it is empty."""
+        if self.first_date is None:
+            return None
+        return self.first_date + datetime.timedelta(days=len(self.prefix) - 2)
+
+    def extend(self, rows):
+        """Appends forecast dates after last_date to the index.
+
+        Args:
+            rows (list): Rows with date and viewers; dates already covered are ignored.
+        """
+        viewers_by_date = {row["date"]: float(row["viewers"] or 0) for row in rows}
+        last_date = self.last_date
+        if last_date is not None:
+            viewers_by_date = {date: viewers for date, viewers in viewers_by_date.items() if date > last_date}
+        if not viewers_by_date:
+            return
+
+        first_date = self.first_date or min(viewers_by_date)
+        start = len(self.prefix) - 1
+        days = (max(viewers_by_date) - first_date).days + 1
+        daily = np.zeros(days - start, dtype=np.float64)
+        for date, viewers in viewers_by_date.items():
+            daily[(date - first_date).days - start] = viewers
+
+        # Build the new array before publishing it to concurrent readers
+        prefix = np.concatenate((self.prefix, self.prefix[-1] + np.cumsum(daily)))
+        self.first_date, self.prefix = first_date, prefix
+
+    def range_total(self, start_date, end_date):
+        """Returns the forecast viewers summed over a date range, inclusive.
+
+        Args:
+            start_date (str): The start date in YYYY-MM-DD format.
+            end_date (str): The end date in YYYY-MM-DD format.
+
+        Returns:
+            float: The total viewers; dates outside the index count as zero.
+        """
+        first_date, prefix = self.first_date, self.prefix
+        if first_date is None:
+            return 0.0
+        days = len(prefix) - 1
+        start = (datetime.date.fromisoformat(start_date) - first_date).days
+        end = (datetime.date.fromisoformat(end_date) - first_date).days + 1
+        start = min(max(start, 0), days)
+        end = min(max(end, start), days)
+        return float(prefix[end] - prefix[start])
+
+    def bucket_totals(self, start_date, end_date, bucket_days=1):
+        """Returns the forecast viewers of consecutive buckets covering a date range.
+
+        Args:
+            start_date (str): The start date in YYYY-MM-DD format.
+            end_date (str): The end date in YYYY-MM-DD format, inclusive.
+            bucket_days (int): Length of each bucket; the last one is cut at end_date.
+
+        Returns:
+            list: (bucket start date, total viewers) tuples in date order.
+        """
+        first = datetime.date.fromisoformat(start_date)
+        days = (datetime.date.fromisoformat(end_date) - first).days + 1
+        if days <= 0:
+            return []
+        offsets = np.append(np.arange(0, days, bucket_days), days)
+
+        first_date, prefix = self.first_date, self.prefix
+        if first_date is None:
+            totals = np.zeros(len(offsets) - 1)
+        else:
+            positions = np.clip(offsets + (first - first_date).days, 0, len(prefix) - 1)
+            totals = np.diff(prefix[positions])
+        return [
+            (first + datetime.timedelta(days=int(offset)), float(total))
+            for offset, total in zip(offsets[:-1], totals)
+        ]
+
+
+def _load_rows(after_date):
+    """Reads daily viewer totals from BigQuery, optionally only after a given date."""
+    bigquery = clients.bigquery_module()
+    bigquery_client = clients.get_bigquery_client()
+    query = """
+    SELECT date, SUM(viewers) AS viewers
+    FROM `aos-demo-toolkit.inventory.daily_viewership_forecast`
+    WHERE @after_date IS NULL OR date > @after_date
+    GROUP BY date
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("after_date", "DATE", after_date)]
+    )
+    return list(bigquery_client.query(query, job_config=job_config).result())
+
+
+def _extend(index):
+    """Adds newly landed dates to an index; on failure the index keeps serving what it has."""
+    try:
+        index.extend(_load_rows(index.last_date))
+        print(f"Viewership index covers {index.first_date} to {index.last_date}")
+    finally:
+        # A failed check is retried after the next interval, not on every request
+        index.checked_at = time.monotonic()
+
+
+def _extend_in_background(index):
+    global _extending
+    try:
+        _extend(index)
+    except Exception as e:
+        print(f"Error extending viewership index, serving dates through {index.last_date}: {str(e)}")
+    finally:
+        _extending = False
+
+
+def get_index():
+    """Returns the process-wide index, loading it on first use.
+
+    Every EXTEND_INTERVAL seconds new dates are added in the background while
+    the current index keeps serving.
+
+    Returns:
+        DailyViewershipIndex: The index.
+    """
+    global _index, _extending
+    index = _index
+    if index is None:
+        with _lock:
+            if _index is None:
+                index = DailyViewershipIndex()
+                _extend(index)
+                _index = index
+            return _index
+
+    if time.monotonic() - index.checked_at >= EXTEND_INTERVAL:
+        with _lock:
+            if not _extending:
+                _extending = True
+                threading.Thread(target=_extend_in_background, args=(index,), daemon=True).start()
+    return index
+
+
+def reset_index():
+    """Drops the index so the next lookup reloads every date, e.g. after forecasts are restated."""
+    global _index
+    with _lock:
+        _index = None
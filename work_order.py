@@ -1,5 +1,13 @@
 
-from google.cloud import storage
+import aos_auth
+import aos_client
+import asyncio
+from cache import TTLCache
+import clients
+import hashlib
+import job_queue
+import pdf_renderer
+import work_order_template
 import json
 import datetime
 from decimal import Decimal
@@ -7,13 +15,13 @@ from decimal import Decimal
 
 import logging
 import os
-import requests
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import threading
 
-# Only import WeasyPrint if PDF generation is not disabled
+# PDFs are rendered by WeasyPrint in the pdf_renderer worker processes
 DISABLE_PDF = os.environ.get('DISABLE_PDF') == '1'
-if not DISABLE_PDF:
-    from weasyprint import HTML
 
 # Suppress WeasyPrint and fontTools debug/info logs
 logging.getLogger("weasyprint").setLevel(logging.WARNING)
@@ -22,6 +30,27 @@ logging.getLogger("PIL").setLevel(logging.WARNING)
 logging.getLogger("cairocffi").setLevel(logging.WARNING)
 logging.getLogger("py.warnings").setLevel(logging.ERROR)
 
+# Public bucket and folder the work order files are saved to
+WORK_ORDER_BUCKET = "aos-demo-public"
+WORK_ORDER_FOLDER = "work_orders"
+
+# Pointers from an order's content hash to its rendered files, so re-pushes of an
+# unchanged order reuse them instead of rendering and uploading again
+WORK_ORDER_INDEX_FOLDER = "work_orders/index"
+REUSE_ARTIFACTS = os.getenv("WORK_ORDER_REUSE", "1") == "1"
+artifact_index = TTLCache(maxsize=1024, ttl=int(os.getenv("WORK_ORDER_INDEX_TTL", str(24 * 3600))))
+
+# Concurrent orders and maximum orders per request of /work_order_batch
+BATCH_WORKERS = int(os.getenv("WORK_ORDER_BATCH_WORKERS", "8"))
+BATCH_MAX_ORDERS = int(os.getenv("WORK_ORDER_BATCH_MAX_ORDERS", "5000"))
+
+# Inputs of the rendered page; other payload fields do not change the work order
+ORDER_FIELDS = ("name", "sourceOrderId", "startDate", "endDate", "advertiserId", "salesPersonName", "salesPersonEmailId", "traffickerName")
+LINE_ITEM_FIELDS = ("name", "productName", "quantity", "costType", "unitCost", "startDate", "endDate")
+TEMPLATE_VERSION = hashlib.sha256(
+    (work_order_template.STYLE + work_order_template.PAGE + work_order_template.LINE_ITEM_ROW).encode('utf-8')
+).hexdigest()
+
 def generate_work_order_html(order_data):
     """Generate HTML work order from order JSON data.
     
@@ -31,357 +60,268 @@ def generate_work_order_html(order_data):
     Returns:
         str: Generated HTML content
     """
-    
-    # Calculate totals
-    total_quantity = sum(item['quantity'] for item in order_data['lineitems'])
-    total_cost = sum(item['quantity'] * item['unitCost'] / 1000 for item in order_data['lineitems'])  # CPM calculation
-    
-    # Generate line items HTML
-    line_items_html = ""
-    for item in order_data['lineitems']:
-        item_cost = item['quantity'] * item['unitCost'] / 1000  # CPM calculation
-        line_items_html += f"""
-            <tr>
-                <td>{item['name']}</td>
-                <td>{item['productName']}</td>
-                <td>{item['quantity']:,}</td>
-                <td>{item['costType']}</td>
-                <td>${item['unitCost']:.2f}</td>
-                <td class="cost-info">${item_cost:,.2f}</td>
-                <td>{item['startDate']} - {item['endDate']}</td>
-            </tr>"""
-    
-    html_content = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{order_data['name']} Work Order</title>
-    <style>
-        @media print {{
-            body {{ margin: 0; }}
-            .no-print {{ display: none; }}
-        }}
-        
-        body {{
-            font-family: Arial, sans-serif;
-            line-height: 1.4;
-            margin: 20px;
-            color: #333;
-        }}
-        
-        .header {{
-            text-align: center;
-            border-bottom: 3px solid #2c5aa0;
-            padding-bottom: 20px;
-            margin-bottom: 30px;
-        }}
-        
-        .company-name {{
-            font-size: 28px;
-            font-weight: bold;
-            color: #2c5aa0;
-            margin-bottom: 5px;
-        }}
-        
-        .work-order-title {{
-            font-size: 20px;
-            color: #666;
-            margin-bottom: 10px;
-        }}
-        
-        .campaign-name {{
-            font-size: 24px;
-            color: #2c5aa0;
-            font-weight: bold;
-            margin: 10px 0;
-        }}
-        
-        .order-info {{
-            display: flex;
-            justify-content: space-between;
-            margin-bottom: 30px;
-            background-color: #f8f9fa;
-            padding: 15px;
-            border-radius: 5px;
-        }}
-        
-        .order-details, .production-details {{
-            flex: 1;
-        }}
-        
-        .order-details h3, .production-details h3 {{
-            margin: 0 0 10px 0;
-            color: #2c5aa0;
-            font-size: 16px;
-        }}
-        
-        .detail-item {{
-            margin-bottom: 5px;
-        }}
-        
-        .label {{
-            font-weight: bold;
-            display: inline-block;
-            width: 120px;
-        }}
-        
-        .items-table {{
-            width: 100%;
-            border-collapse: collapse;
-            margin-bottom: 30px;
-        }}
-        
-        .items-table th,
-        .items-table td {{
-            border: 1px solid #ddd;
-            padding: 12px;
-            text-align: left;
-        }}
-        
-        .items-table th {{
-            background-color: #2c5aa0;
-            color: white;
-            font-weight: bold;
-        }}
-        
-        .items-table tr:nth-child(even) {{
-            background-color: #f9f9f9;
-        }}
-        
-        .cost-info {{
-            text-align: right;
-            font-weight: bold;
-            color: #2c5aa0;
-        }}
-        
-        .total-section {{
-            border-top: 2px solid #2c5aa0;
-            padding-top: 15px;
-            text-align: right;
-        }}
-        
-        .total-amount {{
-            font-size: 18px;
-            font-weight: bold;
-            color: #2c5aa0;
-        }}
-        
-        .footer {{
-            margin-top: 40px;
-            padding-top: 20px;
-            border-top: 1px solid #ddd;
-        }}
-        
-        .signature-section {{
-            display: flex;
-            justify-content: space-between;
-            margin-top: 30px;
-        }}
-        
-        .signature-box {{
-            width: 30%;
-            border-bottom: 1px solid #333;
-            padding-bottom: 5px;
-            text-align: center;
-        }}
-        
-        .print-btn {{
-            background-color: #2c5aa0;
-            color: white;
-            border: none;
-            padding: 10px 20px;
-            border-radius: 5px;
-            cursor: pointer;
-            margin-bottom: 20px;
-        }}
-        
-        .print-btn:hover {{
-            background-color: #1e4080;
-        }}
-        
-        .status-badge {{
-            background-color: #4caf50;
-            color: white;
-            padding: 5px 10px;
-            border-radius: 3px;
-            font-size: 12px;
-        }}
-        
-        .disney-highlight {{
-            background: linear-gradient(135deg, #1e3a8a, #3b82f6);
-            color: white;
-            padding: 15px;
-            border-radius: 8px;
-            text-align: center;
-            margin-bottom: 20px;
-            font-size: 16px;
-        }}
-    </style>
-</head>
-<body>
-    <button class="print-btn no-print" onclick="window.print()">🖨️ Print Work Order</button>
-    
-    <div class="header">
-        <div class="company-name">VINYL SIGNAGE WORK ORDER</div>
-        <div class="work-order-title">DOOH Field Advertising Production Request</div>
-        <div class="campaign-name">{order_data['name']}</div>
-    </div>
-    
-    <div class="disney-highlight">
-        <strong>🏰 Premium Client Campaign - {order_data['name']} 🏰</strong><br>
-        Digital Out-of-Home (DOOH) Field Signage Production
-    </div>
-    
-    <div class="order-info">
-        <div class="order-details">
-            <h3>Order Information</h3>
-            <div class="detail-item"><span class="label">Order ID:</span> {order_data['sourceOrderId']}</div>
-            <div class="detail-item"><span class="label">Campaign:</span> {order_data['name']}</div>
-            <div class="detail-item"><span class="label">Start Date:</span> {order_data['startDate']}</div>
-            <div class="detail-item"><span class="label">End Date:</span> {order_data['endDate']}</div>
-            <div class="detail-item"><span class="label">Advertiser ID:</span> {order_data['advertiserId']}</div>
-        </div>
-        <div class="production-details">
-            <h3>Production Timeline</h3>
-            <div class="detail-item"><span class="label">Created:</span> {datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}</div>
-            <div class="detail-item"><span class="label">Status:</span> <span class="status-badge">PENDING</span></div>
-            <div class="detail-item"><span class="label">Priority:</span> High</div>
-            <div class="detail-item"><span class="label">Deadline:</span> {order_data['startDate']}</div>
-        </div>
-    </div>
-    
-    <div style="background-color: #e3f2fd; padding: 15px; border-radius: 5px; margin-bottom: 20px;">
-        <h3 style="color: #1565c0; margin-top: 0;">Sales Contact Information</h3>
-        <div class="detail-item"><span class="label">Sales Person:</span> {order_data['salesPersonName']}</div>
-        <div class="detail-item"><span class="label">Email:</span> {order_data['salesPersonEmailId']}</div>
-        <div class="detail-item"><span class="label">Trafficker:</span> {order_data.get('traffickerName', 'To be assigned')}</div>
-    </div>
-    
-    <table class="items-table">
-        <thead>
-            <tr>
-                <th>Line Item Name</th>
-                <th>Product</th>
-                <th>Quantity</th>
-                <th>Cost Type</th>
-                <th>Unit Cost</th>
-                <th>Total Cost</th>
-                <th>Flight Dates</th>
-            </tr>
-        </thead>
-        <tbody>
-            {line_items_html}
-        </tbody>
-    </table>
-    
-    <div class="total-section">
-        <div style="margin-bottom: 10px;">
-            <strong>Total Impressions: {total_quantity:,}</strong>
-        </div>
-        <div style="margin-bottom: 10px;">
-            <strong>Total Line Items: {len(order_data['lineitems'])}</strong>
-        </div>
-        <div class="total-amount">
-            <strong>Campaign Total: ${total_cost:,.2f}</strong>
-        </div>
-    </div>
-    
-    <div style="margin-top: 30px; background-color: #fff3e0; padding: 15px; border-radius: 5px; border-left: 4px solid #ff9800;">
-        <h3 style="color: #e65100; margin-top: 0;">🎯 DOOH Production Requirements:</h3>
-        <ul style="margin: 10px 0;">
-            <li>High-resolution graphics suitable for outdoor viewing</li>
-            <li>Weather-resistant vinyl material</li>
-            <li>UV-resistant inks for extended outdoor exposure</li>
-            <li>Professional installation and mounting hardware</li>
-            <li>Compliance with venue signage specifications</li>
-        </ul>
-    </div>
-    
-    <div style="margin-top: 20px; background-color: #f3e5f5; padding: 15px; border-radius: 5px;">
-        <h4 style="color: #7b1fa2; margin-top: 0;">⚠️ Special Production Notes:</h4>
-        <ul style="margin: 5px 0;">
-            <li>Coordinate with venue management for installation timing</li>
-            <li>Ensure all designs meet brand guidelines</li>
-            <li>Schedule quality control inspection before installation</li>
-            <li>Provide installation photography for campaign verification</li>
-        </ul>
-    </div>
-    
-    <div class="signature-section">
-        <div class="signature-box">
-            <div style="margin-top: 20px;">Production Manager</div>
-        </div>
-        <div class="signature-box">
-            <div style="margin-top: 20px;">Sales Representative</div>
-        </div>
-        <div class="signature-box">
-            <div style="margin-top: 20px;">Client Approval</div>
-        </div>
-    </div>
-    
-    <div class="footer">
-        <p><strong>{order_data['name']} - Work Order Details:</strong></p>
-        <ul style="margin: 5px 0; padding-left: 20px;">
-            <li>Order generated on {datetime.datetime.now().strftime("%Y-%m-%d at %H:%M:%S")}</li>
-            <li>Campaign duration: {order_data['startDate']} to {order_data['endDate']}</li>
-            <li>Total line items: {len(order_data['lineitems'])}</li>
-            <li>Production priority: High</li>
-        </ul>
-        <p style="margin-top: 15px; font-style: italic;">
-            This work order is automatically generated from the campaign management system. 
-            Please verify all details before proceeding with production.
-        </p>
-    </div>
-</body>
-</html>"""
-    
-    return html_content
+    return work_order_template.render_work_order_html(order_data)
+
+def work_order_filenames(order_name, order_id=None):
+    """Build the timestamped HTML and PDF filenames of a work order.
 
-def save_work_order_to_gcs(html_content, order_name):
-    """Save the generated HTML (and PDF if enabled) work order to Google Cloud Storage.
-    
     Args:
-        html_content (str): The generated HTML content
         order_name (str): Name of the order for the filename
+        order_id (str): Added to the filename when given, so orders sharing a
+            name in the same second (e.g. in a batch) do not overwrite each other
     Returns:
-        dict: Filenames of the saved work order (HTML and PDF if enabled)
+        dict: HTML and PDF filenames
     """
-    # Get a reference to the GCS bucket
-    bucket_name = "aos-demo-public"
-    folder_name = "work_orders"
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    
     # Generate timestamp for filename
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    
+
     # Create filename
     safe_order_name = "".join(c for c in order_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
     safe_order_name = safe_order_name.replace(' ', '_')
-    html_filename = f"work_order_{safe_order_name}_{timestamp}.html"
-    pdf_filename = f"work_order_{safe_order_name}_{timestamp}.pdf"
-    
-    # Construct the full path within the bucket
-    html_blob = bucket.blob(f"{folder_name}/{html_filename}")
-    html_blob.upload_from_string(
-        data=html_content,
-        content_type='text/html'
+    if order_id is not None:
+        safe_order_name += "_" + "".join(c for c in str(order_id) if c.isalnum() or c in ('-', '_'))
+    return {
+        "html": f"work_order_{safe_order_name}_{timestamp}.html",
+        "pdf": f"work_order_{safe_order_name}_{timestamp}.pdf"
+    }
+
+def work_order_hash(order_data):
+    """Hash the fields of an order that the work order is rendered from.
+
+    The template version is part of the hash, so a template change renders
+    every order afresh.
+
+    Args:
+        order_data (dict): Order data in the format of order_sample.json
+    Returns:
+        str: Hex SHA-256 of the normalized order
+    """
+    normalized = {
+        "template": TEMPLATE_VERSION,
+        "order": {field: order_data.get(field) for field in ORDER_FIELDS},
+        "lineitems": [{field: item.get(field) for field in LINE_ITEM_FIELDS} for item in order_data['lineitems']]
+    }
+    payload = json.dumps(normalized, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def find_work_order_artifacts(content_hash):
+    """Look up previously rendered files of an order, in memory first and then in GCS.
+
+    Returns:
+        dict: HTML and PDF filenames, or None if the order has to be rendered.
+    """
+    artifacts = artifact_index.get(content_hash)
+    if artifacts is None:
+        # The pointer object carries the filenames in its metadata, so one request answers the lookup
+        blob = clients.get_bucket(WORK_ORDER_BUCKET).get_blob(f"{WORK_ORDER_INDEX_FOLDER}/{content_hash}.json")
+        if blob is None:
+            return None
+        artifacts = dict(blob.metadata or {})
+        artifact_index.set(content_hash, artifacts)
+    if "html" not in artifacts or (not DISABLE_PDF and "pdf" not in artifacts):
+        return None
+    return artifacts
+
+def record_work_order_artifacts(content_hash, artifacts):
+    """Remember the files rendered for an order, in memory and as a pointer object in GCS."""
+    artifact_index.set(content_hash, artifacts)
+    blob = clients.get_bucket(WORK_ORDER_BUCKET).blob(f"{WORK_ORDER_INDEX_FOLDER}/{content_hash}.json")
+    blob.metadata = artifacts
+    blob.upload_from_string(
+        data=json.dumps(artifacts),
+        content_type='application/json'
     )
+
+def upload_work_order_file(filename, data, content_type, content_hash=None):
+    """Upload one work order file to the public work_orders folder."""
+    blob = clients.get_bucket(WORK_ORDER_BUCKET).blob(f"{WORK_ORDER_FOLDER}/{filename}")
+    if content_hash:
+        blob.metadata = {"content-hash": content_hash}
+    blob.upload_from_string(
+        data=data,
+        content_type=content_type
+    )
+
+def queue_pdf(html_content, pdf_filename, content_hash=None, on_uploaded=None):
+    """Queue the work order PDF for rendering; it is uploaded when the render finishes.
+
+    Never waits for a render slot, so a burst of orders does not hold up the
+    order push. The response and the AOS note already link the PDF by then,
+    so a render or upload failure is logged with the filename that will be missing.
+
+    Args:
+        html_content (str): The generated HTML content
+        pdf_filename (str): Filename of the PDF in the work_orders folder
+        content_hash (str): Hash of the order, stored in the PDF's metadata
+        on_uploaded (callable): Called without arguments once the PDF is uploaded
+    Raises:
+        pdf_renderer.QueueFull: The render queue is full
+        BrokenProcessPool: The render pool could not be restarted
+    """
+    def missing(e):
+        print(f"Work order PDF {pdf_filename} is missing, its links are broken: {str(e)}")
+
+    def upload(pdf_bytes):
+        try:
+            upload_work_order_file(pdf_filename, pdf_bytes, 'application/pdf', content_hash)
+        except Exception as e:
+            missing(e)
+            return
+        if on_uploaded:
+            on_uploaded()
+
+    return pdf_renderer.submit(html_content, on_done=upload, on_error=missing, timeout=0)
+
+def extract_aos_credentials(basic_auth):
+    """Extract the AOS API credentials from the Basic auth header built by /creds."""
+    encoded_auth = basic_auth.split(" ")[1]
+    decoded_auth = base64.b64decode(encoded_auth).decode('utf-8')
+    user_info, password_info = decoded_auth.split(':')
+    api_user, api_tenant_name, production_system_name, ftp_user, ftp_host, ftp_folder = user_info.split('||')
+    api_pass, api_key, ftp_pass = password_info.split('||')
+    return {
+        'api_user': api_user,
+        'api_tenant_name': api_tenant_name,
+        'production_system_name': production_system_name,
+        'api_pass': api_pass,
+        'api_key': api_key
+    }
+
+def get_workstream_id(env_url, api_key, token, order_sequence_id):
+    url = f"https://{env_url}/orders/v1/{api_key}/workstreams/_search"
+    headers = {"Authorization": f"Bearer {token}"}
+    payload = {"orderSequenceId": int(order_sequence_id)}
+    response = aos_client.post("workstreams_search", url, json=payload, headers=headers, idempotent=True)
+    ws = response.json()["workstreams"][0]
+    return ws["id"], ws["name"]
+
+def call_with_token(call, env_url, creds):
+    """Call call(token) with a cached bearer token, fetching a new one if AOS rejects it."""
+    return aos_auth.call_with_token(call, f"https://{env_url}/mayiservice/tenant/", creds['api_tenant_name'], creds['api_user'], creds['api_pass'], creds['api_key'])
+
+def lookup_workstream(basic_auth, env_url, order_sequence_id):
+    """Fetch the AOS credentials and the order's workstream, the AOS inputs of the note.
+
+    Returns:
+        tuple: (creds, workstream_id, workstream_name)
+    """
+    creds = extract_aos_credentials(basic_auth)
+    workstream_id, workstream_name = call_with_token(
+        lambda token: get_workstream_id(env_url, creds['api_key'], token, order_sequence_id), env_url, creds
+    )
+    return creds, workstream_id, workstream_name
+
+def post_aos_note(env_url, creds, workstream_id, workstream_name, order_id, order_name, html_filename, pdf_filename):
+    url = f"https://{env_url}/notes/v2/{creds['api_key']}/notes"
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    subject = f"Work Order {now}"
+    html_url = f"https://storage.googleapis.com/aos-demo-public/work_orders/{html_filename}"
+    links = f'<a href="{html_url}" rel="noopener noreferrer" target="_blank">html</a>'
+    if pdf_filename:
+        pdf_url = f"https://storage.googleapis.com/aos-demo-public/work_orders/{pdf_filename}"
+        links += f' <a href="{pdf_url}" rel="noopener noreferrer" target="_blank">pdf</a>'
+    note = f'<p>Work Order Form: {links}</p>'
+    note_json = {
+        "sourceEntityId": workstream_id,
+        "entityIds": [workstream_id],
+        "parentEntityId": workstream_id,
+        "sharedEntities": [{"sharedEnityId": None, "sharedEnityType": "Order"}],
+        "note": note,
+        "noteType": "Traffic Instructions",
+        "entityType": "Workstream",
+        "entityName": f"Workstream Name: {workstream_name}",
+        "scope": "External",
+        "subjectParams": f"Order ID: {order_id} | Order Name: {order_name}",
+        "additionalInfo": f"Order ID: {order_id}, Order Name: {order_name}, Workstream Name: {workstream_name}",
+        "taggedUsers": [],
+        "subjectPrefix": subject
+    }
+    def post_note(token):
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        return aos_client.post("notes", url, json=[note_json], headers=headers)
+    return call_with_token(post_note, env_url, creds).json()
+
+def render_work_order(order_data, content_hash=None, wait_for_pdf=False, unique_filenames=False):
+    """Render the work order, save the HTML and hand the PDF to the render pool.
+
+    When a content hash is given, the files are recorded under it once both
+    are uploaded, so later pushes of the same order can reuse them.
+
+    Args:
+        order_data (dict): Order data in the format of order_sample.json
+        content_hash (str): Hash of the order from work_order_hash
+        wait_for_pdf (bool): Return only once the PDF is uploaded too, instead
+            of leaving it to a callback
+        unique_filenames (bool): Include the order id in the filenames
+    Returns:
+        dict: HTML and PDF filenames
+    """
+    html_content = generate_work_order_html(order_data)
+    filenames = work_order_filenames(order_data['name'], order_data['sourceOrderId'] if unique_filenames else None)
+    if DISABLE_PDF:
+        del filenames["pdf"]
+
+    # Whichever upload finishes last records the files
+    uploads_left = [len(filenames)]
+    uploads_lock = threading.Lock()
+
+    def uploaded():
+        with uploads_lock:
+            uploads_left[0] -= 1
+            done = uploads_left[0] == 0
+        if done and content_hash:
+            record_work_order_artifacts(content_hash, dict(filenames))
+
+    def skip_pdf(e):
+        # Go without the PDF rather than link a file that never comes;
+        # the files are then not recorded for reuse either
+        nonlocal content_hash
+        print(f"Skipping work order PDF {filenames['pdf']}: {str(e) or type(e).__name__}")
+        del filenames["pdf"]
+        content_hash = None
+
+    # The PDF renders while the HTML uploads
+    pdf_future = None
     if not DISABLE_PDF:
-        pdf_blob = bucket.blob(f"{folder_name}/{pdf_filename}")
-        pdf_bytes = HTML(string=html_content).write_pdf()
-        pdf_blob.upload_from_string(
-            data=pdf_bytes,
-            content_type='application/pdf'
-        )
-        return {"html": html_filename, "pdf": pdf_filename}
-    else:
-        return {"html": html_filename, "pdf": "test.pdf"}
+        try:
+            if wait_for_pdf:
+                pdf_future = pdf_renderer.submit(html_content)
+            else:
+                queue_pdf(html_content, filenames["pdf"], content_hash, on_uploaded=uploaded)
+        except (pdf_renderer.QueueFull, BrokenProcessPool) as e:
+            skip_pdf(e)
+    upload_work_order_file(filenames["html"], html_content, 'text/html', content_hash)
+    uploaded()
+    if pdf_future:
+        try:
+            pdf_bytes = pdf_future.result()
+        except BrokenProcessPool as e:
+            skip_pdf(e)
+        else:
+            upload_work_order_file(filenames["pdf"], pdf_bytes, 'application/pdf', content_hash)
+            uploaded()
+    return filenames
+
+def get_or_render_work_order(order_data, wait_for_pdf=False, unique_filenames=False):
+    """Reuse the files of an identical earlier order, or render new ones.
+
+    Returns:
+        tuple: (dict of HTML and PDF filenames, whether they were reused)
+    """
+    content_hash = work_order_hash(order_data) if REUSE_ARTIFACTS else None
+    artifacts = find_work_order_artifacts(content_hash) if content_hash else None
+    if artifacts:
+        return dict(artifacts), True
+    return render_work_order(order_data, content_hash, wait_for_pdf=wait_for_pdf, unique_filenames=unique_filenames), False
+
+async def generate_work_order_async(order_data, basic_auth=None, env_url=None):
+    """Generate the work order, running the independent side effects concurrently.
+
+    The HTML upload and the token fetch plus workstream lookup start together;
+    only the AOS note waits for them. The PDF is rendered and uploaded by the
+    pdf_renderer pool and does not hold up the response. An order identical to
+    an earlier one reuses that order's files and skips rendering altogether.
 
-def generate_work_order(order_data, basic_auth=None, env_url=None):
-    """Main function to generate work order HTML and PDF, save to GCS, and post AOS note.
-    
     Args:
         order_data (dict): Order data in the format of order_sample.json
         basic_auth (str): Basic auth header for AOS API (optional, required for note posting)
@@ -390,85 +330,38 @@ def generate_work_order(order_data, basic_auth=None, env_url=None):
         dict: Response with status and filenames
     """
     try:
-        # Generate HTML content
-        html_content = generate_work_order_html(order_data)
-        # Save to GCS (HTML and PDF)
-        filenames = save_work_order_to_gcs(html_content, order_data['name'])
+        # Start the AOS lookups first so they overlap with the uploads
+        workstream_task = None
+        if basic_auth and env_url:
+            workstream_task = asyncio.create_task(
+                asyncio.to_thread(lookup_workstream, basic_auth, env_url, order_data['sourceOrderId'])
+            )
+
+        try:
+            filenames, reused = await asyncio.to_thread(get_or_render_work_order, order_data)
+        except Exception:
+            if workstream_task:
+                workstream_task.cancel()
+            raise
+
         result = {
             "status": "success",
-            "message": "Work order generated successfully",
+            "message": "Work order reused from an identical earlier order" if reused else "Work order generated successfully",
             "html_filename": filenames["html"],
             "order_name": order_data['name'],
             "order_id": order_data['sourceOrderId']
         }
-        if not DISABLE_PDF and "pdf" in filenames:
+        if DISABLE_PDF:
+            filenames["pdf"] = "test.pdf"
+        elif "pdf" in filenames:
             result["pdf_filename"] = filenames["pdf"]
+        else:
+            result["pdf_error"] = "PDF could not be rendered, the work order has no PDF"
         # Post AOS note if credentials provided
-        if basic_auth and env_url:
+        if workstream_task:
             try:
-                # Inline AOS note logic (from work_order_aos_note.py)
-                def extract_aos_credentials(basic_auth):
-                    encoded_auth = basic_auth.split(" ")[1]
-                    decoded_auth = base64.b64decode(encoded_auth).decode('utf-8')
-                    user_info, password_info = decoded_auth.split(':')
-                    api_user, api_tenant_name, production_system_name, ftp_user, ftp_host, ftp_folder = user_info.split('||')
-                    api_pass, api_key, ftp_pass = password_info.split('||')
-                    return {
-                        'api_user': api_user,
-                        'api_tenant_name': api_tenant_name,
-                        'production_system_name': production_system_name,
-                        'api_pass': api_pass,
-                        'api_key': api_key
-                    }
-                def get_bearer_token(env_url, api_tenant_name, api_user, api_pass, api_key):
-                    url = f"https://{env_url}/mayiservice/tenant/{api_tenant_name}"
-                    payload = {
-                        "expiration": 360,
-                        "password": api_pass,
-                        "userId": api_user,
-                        "apiKey": api_key
-                    }
-                    response = requests.post(url, json=payload)
-                    response.raise_for_status()
-                    return response.json().get("token")
-                def get_workstream_id(env_url, api_key, token, order_sequence_id):
-                    url = f"https://{env_url}/orders/v1/{api_key}/workstreams/_search"
-                    headers = {"Authorization": f"Bearer {token}"}
-                    payload = {"orderSequenceId": int(order_sequence_id)}
-                    response = requests.post(url, json=payload, headers=headers)
-                    response.raise_for_status()
-                    ws = response.json()["workstreams"][0]
-                    return ws["id"], ws["name"]
-                def post_aos_note(env_url, api_key, token, workstream_id, workstream_name, order_id, order_name, html_filename, pdf_filename):
-                    url = f"https://{env_url}/notes/v2/{api_key}/notes"
-                    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-                    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-                    subject = f"Work Order {now}"
-                    html_url = f"https://storage.googleapis.com/aos-demo-public/work_orders/{html_filename}"
-                    pdf_url = f"https://storage.googleapis.com/aos-demo-public/work_orders/{pdf_filename}"
-                    note = f'<p>Work Order Form: <a href="{html_url}" rel="noopener noreferrer" target="_blank">html</a> <a href="{pdf_url}" rel="noopener noreferrer" target="_blank">pdf</a></p>'
-                    note_json = {
-                        "sourceEntityId": workstream_id,
-                        "entityIds": [workstream_id],
-                        "parentEntityId": workstream_id,
-                        "sharedEntities": [{"sharedEnityId": None, "sharedEnityType": "Order"}],
-                        "note": note,
-                        "noteType": "Traffic Instructions",
-                        "entityType": "Workstream",
-                        "entityName": f"Workstream Name: {workstream_name}",
-                        "scope": "External",
-                        "subjectParams": f"Order ID: {order_id} | Order Name: {order_name}",
-                        "additionalInfo": f"Order ID: {order_id}, Order Name: {order_name}, Workstream Name: {workstream_name}",
-                        "taggedUsers": [],
-                        "subjectPrefix": subject
-                    }
-                    response = requests.post(url, json=[note_json], headers=headers)
-                    response.raise_for_status()
-                    return response.json()
-                creds = extract_aos_credentials(basic_auth)
-                token = get_bearer_token(env_url, creds['api_tenant_name'], creds['api_user'], creds['api_pass'], creds['api_key'])
-                workstream_id, workstream_name = get_workstream_id(env_url, creds['api_key'], token, order_data['sourceOrderId'])
-                note_result = post_aos_note(env_url, creds['api_key'], token, workstream_id, workstream_name, order_data['sourceOrderId'], order_data['name'], filenames["html"], filenames["pdf"])
+                creds, workstream_id, workstream_name = await workstream_task
+                note_result = await asyncio.to_thread(post_aos_note, env_url, creds, workstream_id, workstream_name, order_data['sourceOrderId'], order_data['name'], filenames["html"], filenames.get("pdf"))
                 result["note_result"] = note_result
             except Exception as note_err:
                 result["note_error"] = str(note_err)
@@ -481,6 +374,131 @@ def generate_work_order(order_data, basic_auth=None, env_url=None):
             "order_id": order_data.get('sourceOrderId', 'Unknown')
         }
 
+def generate_work_order(order_data, basic_auth=None, env_url=None):
+    """Main function to generate work order HTML and PDF, save to GCS, and post AOS note.
+    
+    Args:
+        order_data (dict): Order data in the format of order_sample.json
+        basic_auth (str): Basic auth header for AOS API (optional, required for note posting)
+        env_url (str): AOS environment URL (optional, required for note posting)
+    Returns:
+        dict: Response with status and filenames
+    """
+    return asyncio.run(generate_work_order_async(order_data, basic_auth=basic_auth, env_url=env_url))
+
+def run_work_order_job(payload):
+    """Job queue handler generating a work order in the background."""
+    result = generate_work_order(payload["order_data"], basic_auth=payload["basic_auth"], env_url=payload["env_url"])
+    print(f"Work order generation result: {result}")
+
+job_queue.register("work_order", run_work_order_job)
+
+def generate_batch_entry(index, order_data):
+    """Generate one order of a batch and describe the outcome for the manifest.
+
+    Unlike the single order endpoint, this waits for the PDF upload so the
+    manifest only reports files that exist. No AOS notes are posted.
+    """
+    entry = {"index": index}
+    try:
+        if isinstance(order_data, Exception):
+            raise order_data
+        filenames, reused = get_or_render_work_order(order_data, wait_for_pdf=True, unique_filenames=True)
+        entry.update({
+            "status": "success",
+            "reused": reused,
+            "order_name": order_data['name'],
+            "order_id": order_data['sourceOrderId'],
+            "html_filename": filenames["html"]
+        })
+        if "pdf" in filenames:
+            entry["pdf_filename"] = filenames["pdf"]
+        elif not DISABLE_PDF:
+            entry["pdf_error"] = "PDF could not be rendered, the work order has no PDF"
+    except Exception as e:
+        entry.update({
+            "status": "error",
+            "message": f"Failed to generate work order: {str(e)}"
+        })
+        if isinstance(order_data, dict):
+            entry["order_name"] = order_data.get('name', 'Unknown')
+            entry["order_id"] = order_data.get('sourceOrderId', 'Unknown')
+    return entry
+
+def generate_work_orders(orders):
+    """Generate work orders for many orders at once.
+
+    Orders run on BATCH_WORKERS threads: HTML renders and GCS uploads overlap,
+    and the PDFs are spread over the pdf_renderer process pool, which blocks
+    submitters for up to PDF_SUBMIT_TIMEOUT seconds once its queue is full.
+
+    Args:
+        orders (list): Order dicts; an exception in place of an order is
+            reported as that order's error.
+    Returns:
+        dict: Manifest with counts and one entry per order, in input order
+    """
+    with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+        results = list(executor.map(generate_batch_entry, range(len(orders)), orders))
+    succeeded = sum(1 for entry in results if entry["status"] == "success")
+    reused = sum(1 for entry in results if entry.get("reused"))
+    print(f"Generated {succeeded} of {len(orders)} work orders ({reused} reused)")
+    return {
+        "status": "success" if succeeded == len(orders) else "partial" if succeeded else "error",
+        "total": len(orders),
+        "succeeded": succeeded,
+        "reused": reused,
+        "failed": len(orders) - succeeded,
+        "results": results
+    }
+
+def parse_batch_orders(request):
+    """Read the orders of a batch request.
+
+    Accepts a JSON list of orders, a JSON object with an "orders" list, or
+    NDJSON with one order per line. A malformed NDJSON line becomes an
+    exception in the list, so only that order fails.
+
+    Returns:
+        list: Order dicts, or exceptions for lines that could not be parsed
+    """
+    request_json = request.get_json(silent=True)
+    if isinstance(request_json, dict):
+        request_json = request_json.get("orders")
+    if isinstance(request_json, list):
+        return request_json
+
+    orders = []
+    for line_number, line in enumerate(request.get_data(as_text=True).splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            orders.append(json.loads(line))
+        except ValueError as e:
+            orders.append(ValueError(f"Invalid JSON on line {line_number}: {str(e)}"))
+    return orders
+
+def batch_main(request):
+    """Main function for /work_order_batch, generating the work orders of many orders.
+
+    Args:
+        request: Flask request object with a JSON list of orders or NDJSON
+    Returns:
+        dict: Manifest of the generated work orders
+    """
+    orders = parse_batch_orders(request)
+    if not orders:
+        return {
+            "status": "error",
+            "message": "Request must contain a JSON list of orders or NDJSON"
+        }
+    if len(orders) > BATCH_MAX_ORDERS:
+        return {
+            "status": "error",
+            "message": f"At most {BATCH_MAX_ORDERS} orders per batch, got {len(orders)}"
+        }
+    return generate_work_orders(orders)
+
 def main(request):
     """Main function called from orders.py or main.py.
     
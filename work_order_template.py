@@ -0,0 +1,384 @@
+import datetime
+from string import Formatter
+
+# Work order stylesheet, inlined into every page
+STYLE = """        @media print {
+            body { margin: 0; }
+            .no-print { display: none; }
+        }
+        
+        body {
+            font-family: Arial, sans-serif;
+            line-height: 1.4;
+            margin: 20px;
+            color: #333;
+        }
+        
+        .header {
+            text-align: center;
+            border-bottom: 3px solid #2c5aa0;
+            padding-bottom: 20px;
+            margin-bottom: 30px;
+        }
+        
+        .company-name {
+            font-size: 28px;
+            font-weight: bold;
+            color: #2c5aa0;
+            margin-bottom: 5px;
+        }
+        
+        .work-order-title {
+            font-size: 20px;
+            color: #666;
+            margin-bottom: 10px;
+        }
+        
+        .campaign-name {
+            font-size: 24px;
+            color: #2c5aa0;
+            font-weight: bold;
+            margin: 10px 0;
+        }
+        
+        .order-info {
+            display: flex;
+            justify-content: space-between;
+            margin-bottom: 30px;
+            background-color: #f8f9fa;
+            padding: 15px;
+            border-radius: 5px;
+        }
+        
+        .order-details, .production-details {
+            flex: 1;
+        }
+        
+        .order-details h3, .production-details h3 {
+            margin: 0 0 10px 0;
+            color: #2c5aa0;
+            font-size: 16px;
+        }
+        
+        .detail-item {
+            margin-bottom: 5px;
+        }
+        
+        .label {
+            font-weight: bold;
+            display: inline-block;
+            width: 120px;
+        }
+        
+        .items-table {
+            width: 100%;
+            border-collapse: collapse;
+            margin-bottom: 30px;
+        }
+        
+        .items-table th,
+        .items-table td {
+            border: 1px solid #ddd;
+            padding: 12px;
+            text-align: left;
+        }
+        
+        .items-table th {
+            background-color: #2c5aa0;
+            color: white;
+            font-weight: bold;
+        }
+        
+        .items-table tr:nth-child(even) {
+            background-color: #f9f9f9;
+        }
+        
+        .cost-info {
+            text-align: right;
+            font-weight: bold;
+            color: #2c5aa0;
+        }
+        
+        .total-section {
+            border-top: 2px solid #2c5aa0;
+            padding-top: 15px;
+            text-align: right;
+        }
+        
+        .total-amount {
+            font-size: 18px;
+            font-weight: bold;
+            color: #2c5aa0;
+        }
+        
+        .footer {
+            margin-top: 40px;
+            padding-top: 20px;
+            border-top: 1px solid #ddd;
+        }
+        
+        .signature-section {
+            display: flex;
+            justify-content: space-between;
+            margin-top: 30px;
+        }
+        
+        .signature-box {
+            width: 30%;
+            border-bottom: 1px solid #333;
+            padding-bottom: 5px;
+            text-align: center;
+        }
+        
+        .print-btn {
+            background-color: #2c5aa0;
+            color: white;
+            border: none;
+            padding: 10px 20px;
+            border-radius: 5px;
+            cursor: pointer;
+            margin-bottom: 20px;
+        }
+        
+        .print-btn:hover {
+            background-color: #1e4080;
+        }
+        
+        .status-badge {
+            background-color: #4caf50;
+            color: white;
+            padding: 5px 10px;
+            border-radius: 3px;
+            font-size: 12px;
+        }
+        
+        .disney-highlight {
+            background: linear-gradient(135deg, #1e3a8a, #3b82f6);
+            color: white;
+            padding: 15px;
+            border-radius: 8px;
+            text-align: center;
+            margin-bottom: 20px;
+            font-size: 16px;
+        }
+"""
+
+# Page layout; {style} is filled in once at import, the other fields per order
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{name} Work Order</title>
+    <style>
+{style}    </style>
+</head>
+<body>
+    <button class="print-btn no-print" onclick="window.print()">🖨️ Print Work Order</button>
+    
+    <div class="header">
+        <div class="company-name">VINYL SIGNAGE WORK ORDER</div>
+        <div class="work-order-title">DOOH Field Advertising Production Request</div>
+        <div class="campaign-name">{name}</div>
+    </div>
+    
+    <div class="disney-highlight">
+        <strong>🏰 Premium Client Campaign - {name} 🏰</strong><br>
+        Digital Out-of-Home (DOOH) Field Signage Production
+    </div>
+    
+    <div class="order-info">
+        <div class="order-details">
+            <h3>Order Information</h3>
+            <div class="detail-item"><span class="label">Order ID:</span> {source_order_id}</div>
+            <div class="detail-item"><span class="label">Campaign:</span> {name}</div>
+            <div class="detail-item"><span class="label">Start Date:</span> {start_date}</div>
+            <div class="detail-item"><span class="label">End Date:</span> {end_date}</div>
+            <div class="detail-item"><span class="label">Advertiser ID:</span> {advertiser_id}</div>
+        </div>
+        <div class="production-details">
+            <h3>Production Timeline</h3>
+            <div class="detail-item"><span class="label">Created:</span> {created:%Y-%m-%d %H:%M}</div>
+            <div class="detail-item"><span class="label">Status:</span> <span class="status-badge">PENDING</span></div>
+            <div class="detail-item"><span class="label">Priority:</span> High</div>
+            <div class="detail-item"><span class="label">Deadline:</span> {start_date}</div>
+        </div>
+    </div>
+    
+    <div style="background-color: #e3f2fd; padding: 15px; border-radius: 5px; margin-bottom: 20px;">
+        <h3 style="color: #1565c0; margin-top: 0;">Sales Contact Information</h3>
+        <div class="detail-item"><span class="label">Sales Person:</span> {sales_person_name}</div>
+        <div class="detail-item"><span class="label">Email:</span> {sales_person_email}</div>
+        <div class="detail-item"><span class="label">Trafficker:</span> {trafficker_name}</div>
+    </div>
+    
+    <table class="items-table">
+        <thead>
+            <tr>
+                <th>Line Item Name</th>
+                <th>Product</th>
+                <th>Quantity</th>
+                <th>Cost Type</th>
+                <th>Unit Cost</th>
+                <th>Total Cost</th>
+                <th>Flight Dates</th>
+            </tr>
+        </thead>
+        <tbody>
+            {line_items}
+        </tbody>
+    </table>
+    
+    <div class="total-section">
+        <div style="margin-bottom: 10px;">
+            <strong>Total Impressions: {total_quantity:,}</strong>
+        </div>
+        <div style="margin-bottom: 10px;">
+            <strong>Total Line Items: {line_item_count}</strong>
+        </div>
+        <div class="total-amount">
+            <strong>Campaign Total: ${total_cost:,.2f}</strong>
+        </div>
+    </div>
+    
+    <div style="margin-top: 30px; background-color: #fff3e0; padding: 15px; border-radius: 5px; border-left: 4px solid #ff9800;">
+        <h3 style="color: #e65100; margin-top: 0;">🎯 DOOH Production Requirements:</h3>
+        <ul style="margin: 10px 0;">
+            <li>High-resolution graphics suitable for outdoor viewing</li>
+            <li>Weather-resistant vinyl material</li>
+            <li>UV-resistant inks for extended outdoor exposure</li>
+            <li>Professional installation and mounting hardware</li>
+            <li>Compliance with venue signage specifications</li>
+        </ul>
+    </div>
+    
+    <div style="margin-top: 20px; background-color: #f3e5f5; padding: 15px; border-radius: 5px;">
+        <h4 style="color: #7b1fa2; margin-top: 0;">⚠️ Special Production Notes:</h4>
+        <ul style="margin: 5px 0;">
+            <li>Coordinate with venue management for installation timing</li>
+            <li>Ensure all designs meet brand guidelines</li>
+            <li>Schedule quality control inspection before installation</li>
+            <li>Provide installation photography for campaign verification</li>
+        </ul>
+    </div>
+    
+    <div class="signature-section">
+        <div class="signature-box">
+            <div style="margin-top: 20px;">Production Manager</div>
+        </div>
+        <div class="signature-box">
+            <div style="margin-top: 20px;">Sales Representative</div>
+        </div>
+        <div class="signature-box">
+            <div style="margin-top: 20px;">Client Approval</div>
+        </div>
+    </div>
+    
+    <div class="footer">
+        <p><strong>{name} - Work Order Details:</strong></p>
+        <ul style="margin: 5px 0; padding-left: 20px;">
+            <li>Order generated on {created:%Y-%m-%d at %H:%M:%S}</li>
+            <li>Campaign duration: {start_date} to {end_date}</li>
+            <li>Total line items: {line_item_count}</li>
+            <li>Production priority: High</li>
+        </ul>
+        <p style="margin-top: 15px; font-style: italic;">
+            This work order is automatically generated from the campaign management system. 
+            Please verify all details before proceeding with production.
+        </p>
+    </div>
+</body>
+</html>"""
+
+# One row of the line items table
+LINE_ITEM_ROW = """
+            <tr>
+                <td>{name}</td>
+                <td>{productName}</td>
+                <td>{quantity:,}</td>
+                <td>{costType}</td>
+                <td>${unitCost:.2f}</td>
+                <td class="cost-info">${item_cost:,.2f}</td>
+                <td>{startDate} - {endDate}</td>
+            </tr>"""
+
+
+class CompiledTemplate:
+    """A str.format template parsed once into literal text and field slots.
+
+    Static fields are substituted at compile time and merged into the
+    surrounding literals, so rendering only formats the dynamic fields and
+    joins the pieces, without rescanning the static text on every call.
+    """
+
+    def __init__(self, source, **static):
+        self.parts = []  # literal strings and (field name, format spec) tuples
+        literal = []
+        for text, field, spec, conversion in Formatter().parse(source):
+            literal.append(text)
+            if field is None:
+                continue
+            if conversion:
+                raise ValueError(f"Conversions are not supported: {field}!{conversion}")
+            if field in static:
+                literal.append(format(static[field], spec))
+                continue
+            self.parts.append("".join(literal))
+            self.parts.append((field, spec))
+            literal = []
+        self.parts.append("".join(literal))
+
+    def render(self, context):
+        """Returns the template filled in from a dict of field values."""
+        return "".join(
+            part if isinstance(part, str) else format(context[part[0]], part[1])
+            for part in self.parts
+        )
+
+
+PAGE_TEMPLATE = CompiledTemplate(PAGE, style=STYLE)
+
+
+def render_line_items(lineitems):
+    """Renders the table rows in a single join, so cost stays linear in the number of line items.
+
+    Returns:
+        tuple: (rows html, total quantity, total cost)
+    """
+    rows = []
+    total_quantity = 0
+    total_cost = 0
+    for item in lineitems:
+        item_cost = item['quantity'] * item['unitCost'] / 1000  # CPM calculation
+        total_quantity += item['quantity']
+        total_cost += item_cost
+        rows.append(LINE_ITEM_ROW.format_map({**item, "item_cost": item_cost}))
+    return "".join(rows), total_quantity, total_cost
+
+
+def render_work_order_html(order_data, created=None):
+    """Renders the work order page of an order.
+
+    Args:
+        order_data (dict): Order data in the format of order_sample.json
+        created (datetime.datetime): Generation time shown on the page, defaults to now
+
+    Returns:
+        str: Generated HTML content
+    """
+    line_items, total_quantity, total_cost = render_line_items(order_data['lineitems'])
+    return PAGE_TEMPLATE.render({
+        "name": order_data['name'],
+        "source_order_id": order_data['sourceOrderId'],
+        "start_date": order_data['startDate'],
+        "end_date": order_data['endDate'],
+        "advertiser_id": order_data['advertiserId'],
+        "sales_person_name": order_data['salesPersonName'],
+        "sales_person_email": order_data['salesPersonEmailId'],
+        "trafficker_name": order_data.get('traffickerName', 'To be assigned'),
+        "created": created or datetime.datetime.now(),
+        "line_items": line_items,
+        "line_item_count": len(order_data['lineitems']),
+        "total_quantity": total_quantity,
+        "total_cost": total_cost,
+    })